@@ -0,0 +1,63 @@
+import argparse
+import json
+import sys
+import time
+
+# 匯入 main 會先載入 .env，讓 services 讀到相同的調校參數
+from main import ToolSubmitRequest
+import models
+from database import SessionLocal, engine
+from migrate import run_migrations
+from services.announcement import generate_batch, write_batch_zip, BATCH_RENDER_WORKERS
+from services.generator import start_process_pool, shutdown_process_pool, download_cache, RENDER_PROCESSES
+
+# ==========================================
+# 系辦批次生成口試佈告 (命令列版)
+# 用法：python bulk_generate.py submissions.json [--zip out.zip] [--workers 8]
+# submissions.json 為 submit_and_generate 格式的陣列：
+#   [{"student_id": "...", "defense_date": "2026-06-20", "defense_time": "14:00",
+#     "final_location": "...", "final_committee_str": "甲 教授, 乙 副教授"}, ...]
+# ==========================================
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批次生成口試佈告 PPT")
+    parser.add_argument("submissions", help="submit_and_generate 格式的 JSON 陣列檔")
+    parser.add_argument("--zip", dest="zip_path", help="另外把所有 PPTX 與 manifest.json 打包成此 zip 檔")
+    parser.add_argument("--workers", type=int, default=BATCH_RENDER_WORKERS, help="同時渲染的檔案數")
+    parser.add_argument("--processes", type=int, default=RENDER_PROCESSES, help="渲染行程數 (0 = 不使用行程池)")
+    args = parser.parse_args()
+
+    with open(args.submissions, "r", encoding="utf-8-sig") as f:
+        items = [ToolSubmitRequest(**row) for row in json.load(f)]
+
+    models.Base.metadata.create_all(bind=engine)
+    run_migrations()
+    # 與伺服器啟動時相同，先載入下載目錄既有的檔案，磁碟預算才會把它們算進去
+    download_cache.load()
+    start_process_pool(args.processes)
+    db = SessionLocal()
+    # 要打包時，產出的檔案在寫入 zip 前保持 pin，不會被磁碟快取淘汰
+    pinned = [] if args.zip_path else None
+    started = time.perf_counter()
+    try:
+        manifest = generate_batch(db, items, workers=args.workers, pinned=pinned)
+        elapsed = time.perf_counter() - started
+
+        if args.zip_path:
+            with open(args.zip_path, "wb") as f:
+                write_batch_zip(db, manifest, f)
+            print(f"📦 已打包：{args.zip_path}")
+    finally:
+        if pinned:
+            download_cache.unpin(*pinned)
+        db.close()
+        shutdown_process_pool(wait=True)
+
+    print(json.dumps(manifest, ensure_ascii=False, indent=2))
+    print(f"✅ 完成 {manifest['succeeded']}/{manifest['total']} 筆，耗時 {elapsed:.2f} 秒", file=sys.stderr)
+    return 0 if manifest["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,274 @@
+import argparse
+import csv
+import hashlib
+import os
+import sys
+import time
+from itertools import islice
+from dotenv import load_dotenv
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+# .env 必須在匯入本地模組前載入 (與 main.py 相同)
+load_dotenv(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".env"))
+
+import models
+from database import SessionLocal, engine
+from migrate import run_migrations
+from seed import SEED_TABLES, SEED_UPDATE_EXISTING, blank_foreign_keys_to_null, existing_rows, upsert_rows
+
+# ==========================================
+# 大型名冊 CSV 串流匯入 (命令列版)
+# 用法：python import_csv.py students 全校學生.csv [--chunk-size 1000] [--resume] [--update]
+# 逐區塊讀取、每個區塊一筆交易；有問題的列寫到旁邊的 .rejects.csv，不會讓整批回滾。
+# 斷點與區塊資料一起提交，中斷後加上 --resume 即可從最後提交的區塊接續。
+# ==========================================
+
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class RejectWriter:
+    """被拒絕的列連同行號與原因寫到旁檔，第一次有拒絕才建立檔案"""
+
+    def __init__(self, path: str, fieldnames, append: bool):
+        self.path = path
+        self.fieldnames = ["line", "reason"] + list(fieldnames)
+        self.append = append
+        self.count = 0
+        self._file = None
+        self._writer = None
+
+    def write(self, line: int, row: dict, reason: str):
+        if self._writer is None:
+            exists = self.append and os.path.exists(self.path)
+            self._file = open(self.path, "a" if exists else "w", newline="", encoding="utf-8-sig" if not exists else "utf-8")
+            self._writer = csv.DictWriter(self._file, fieldnames=self.fieldnames, extrasaction="ignore")
+            if not exists:
+                self._writer.writeheader()
+        self._writer.writerow({**row, "line": line, "reason": reason})
+        self.count += 1
+
+    def flush(self):
+        # 斷點提交前呼叫：確定明細已寫到磁碟，之後才能把這個區塊標記為完成
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    @staticmethod
+    def truncate(path: str, keep: int):
+        """
+        續跑前只保留前 keep 筆明細 (= 已提交區塊的拒絕數)；
+        明細先於斷點寫入，上次中斷在兩者之間時，未提交區塊的明細會在重跑時再寫一次，不能留下重複的列
+        """
+        if not os.path.exists(path):
+            return
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            kept = list(islice(reader, keep))
+        with open(path, "w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.writer(f)
+            if header:
+                writer.writerow(header)
+            writer.writerows(kept)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def validate_chunk(db: Session, model, chunk):
+    """
+    檢查必填欄位、區塊內主鍵重複與外鍵 (例如學生的指導教授) 是否存在。
+    回傳 (主鍵 -> 列, 主鍵 -> 行號, [(行號, 列, 原因)])。
+    """
+    table = model.__table__
+    pk = table.primary_key.columns.values()[0]
+    required = [col.name for col in table.columns if not col.nullable or col.primary_key]
+    rows, lines, rejects = {}, {}, []
+
+    for line, row in chunk:
+        if None in row:
+            rejects.append((line, row, "欄位數多於表頭"))
+            continue
+        missing = [name for name in required if not (row.get(name) or "").strip()]
+        if missing:
+            rejects.append((line, row, f"缺少必填欄位：{', '.join(missing)}"))
+            continue
+        key = row[pk.name]
+        if key in rows:
+            rejects.append((line, row, f"主鍵 {key} 與第 {lines[key]} 行重複"))
+            continue
+        rows[key] = blank_foreign_keys_to_null(model, row)
+        lines[key] = line
+
+    for col in table.columns:
+        for fk in col.foreign_keys:
+            values = {row[col.name] for row in rows.values() if row.get(col.name)}
+            if not values:
+                continue
+            found = set(db.scalars(select(fk.column).where(fk.column.in_(values))))
+            for key in [k for k, row in rows.items() if row.get(col.name) and row[col.name] not in found]:
+                row = rows.pop(key)
+                rejects.append((lines.pop(key), row, f"{col.name}={row[col.name]} 不存在於 {fk.column.table.name}"))
+
+    return rows, lines, rejects
+
+
+def import_chunk(db: Session, model, rows: dict, lines: dict, update_existing: bool):
+    """
+    整個區塊一次寫入 (不提交)；萬一仍被資料庫拒絕，改成逐列各自提交找出問題列。
+    逐列重試時已提交的列在續跑時會被視為既有資料，不會重複新增。
+    回傳 (新增筆數, 更新筆數, [(行號, 列, 原因)])。
+    """
+    if not rows:
+        return 0, 0, []
+    try:
+        inserted, updated = upsert_rows(db, model, rows, existing_rows(db, model, rows.keys()), update_existing)
+        return inserted, updated, []
+    except SQLAlchemyError:
+        db.rollback()
+
+    inserted = updated = 0
+    rejects = []
+    for key, row in rows.items():
+        try:
+            i, u = upsert_rows(db, model, {key: row}, existing_rows(db, model, [key]), update_existing)
+            db.commit()
+            inserted += i
+            updated += u
+        except SQLAlchemyError as e:
+            db.rollback()
+            rejects.append((lines[key], row, f"資料庫拒絕：{e.orig if getattr(e, 'orig', None) else e}"))
+    return inserted, updated, rejects
+
+
+def import_csv(db: Session, table_name: str, csv_path: str, chunk_size: int = IMPORT_CHUNK_SIZE,
+               rejects_path: str = None, resume: bool = False, update_existing: bool = SEED_UPDATE_EXISTING) -> dict:
+    model, _, label = SEED_TABLES[table_name]
+    table = model.__table__
+    pk = table.primary_key.columns.values()[0]
+    chunk_size = max(1, chunk_size)
+    source = os.path.abspath(csv_path)
+    rejects_path = rejects_path or f"{os.path.splitext(csv_path)[0]}.rejects.csv"
+    digest = file_sha256(csv_path)
+
+    progress = db.get(models.ImportProgress, (table.name, source))
+    skip = 0
+    if resume and progress is not None and progress.content_sha256 == digest:
+        if progress.finished:
+            print(f"⏭️ {label} ({os.path.basename(csv_path)}) 已完整匯入過，略過")
+            return {"rows": progress.rows_done, "inserted": progress.rows_inserted, "updated": progress.rows_updated,
+                    "rejected": progress.rows_rejected, "elapsed": 0.0, "rows_per_sec": 0.0}
+        skip = progress.rows_done
+        print(f"↩️ 從第 {skip + 1} 筆資料接續匯入 (上次已提交 {skip} 筆)")
+    elif resume and progress is not None:
+        print("⚠️ 檔案內容與上次不同，無法接續，改為從頭匯入")
+
+    if progress is None:
+        progress = models.ImportProgress(table_name=table.name, source_path=source)
+        db.add(progress)
+    if skip == 0:
+        # 從頭匯入時清掉上一次留下的拒絕明細
+        if os.path.exists(rejects_path):
+            os.remove(rejects_path)
+        progress.rows_done = progress.rows_inserted = progress.rows_updated = progress.rows_rejected = 0
+    else:
+        RejectWriter.truncate(rejects_path, progress.rows_rejected)
+    progress.content_sha256 = digest
+    progress.finished = False
+    db.commit()
+
+    processed = 0
+    started = time.perf_counter()
+    # 使用 utf-8-sig 可以過濾掉 Excel 存檔時可能產生的隱藏 BOM 字元
+    with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.DictReader(f)
+        fieldnames = reader.fieldnames or []
+        unknown = [name for name in fieldnames if name not in table.columns]
+        if pk.name not in fieldnames or unknown:
+            raise ValueError(f"CSV 表頭與 {table.name} 不符：缺少 {pk.name}" if pk.name not in fieldnames
+                             else f"CSV 表頭與 {table.name} 不符：未知欄位 {', '.join(unknown)}")
+
+        rows_iter = islice(((reader.line_num, row) for row in reader), skip, None)
+        rejects = RejectWriter(rejects_path, fieldnames, append=skip > 0)
+        try:
+            while True:
+                chunk = list(islice(rows_iter, chunk_size))
+                if not chunk:
+                    break
+                rows, lines, chunk_rejects = validate_chunk(db, model, chunk)
+                inserted, updated, db_rejects = import_chunk(db, model, rows, lines, update_existing)
+                chunk_rejects += db_rejects
+
+                # 拒絕明細先寫入磁碟，斷點才與這個區塊的資料一起提交；
+                # 反過來的話，中斷在兩者之間會讓續跑略過這個區塊，明細就永遠遺失
+                for line, row, reason in sorted(chunk_rejects, key=lambda r: r[0]):
+                    rejects.write(line, row, reason)
+                rejects.flush()
+
+                progress.rows_done += len(chunk)
+                progress.rows_inserted += inserted
+                progress.rows_updated += updated
+                progress.rows_rejected += len(chunk_rejects)
+                db.commit()
+
+                processed += len(chunk)
+                elapsed = time.perf_counter() - started
+                print(f"📥 {label}：已提交 {progress.rows_done} 筆 (新增 {progress.rows_inserted}、"
+                      f"更新 {progress.rows_updated}、拒絕 {progress.rows_rejected})，{processed / elapsed:,.0f} 筆/秒")
+        finally:
+            rejects.close()
+
+    progress.finished = True
+    db.commit()
+    elapsed = time.perf_counter() - started
+    if progress.rows_rejected:
+        print(f"⚠️ 共 {progress.rows_rejected} 筆被拒絕，明細見 {rejects_path}")
+    return {"rows": progress.rows_done, "inserted": progress.rows_inserted, "updated": progress.rows_updated,
+            "rejected": progress.rows_rejected, "elapsed": elapsed,
+            "rows_per_sec": round(processed / elapsed, 1) if elapsed > 0 else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="串流匯入教授/學生/地點 CSV")
+    parser.add_argument("table", choices=list(SEED_TABLES), help="匯入的資料表")
+    parser.add_argument("csv_path", help="CSV 檔 (欄位格式與 data/ 下的同名檔案相同)")
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE, help="每筆交易提交的列數")
+    parser.add_argument("--rejects", help="被拒絕列的輸出檔 (預設為 <csv 檔名>.rejects.csv)")
+    parser.add_argument("--resume", action="store_true", help="從上次最後提交的區塊接續")
+    parser.add_argument("--update", action="store_true", default=SEED_UPDATE_EXISTING,
+                        help="一併更新內容有變動的既有列 (預設只新增)")
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    run_migrations()
+    db = SessionLocal()
+    try:
+        summary = import_csv(db, args.table, args.csv_path, chunk_size=args.chunk_size,
+                             rejects_path=args.rejects, resume=args.resume, update_existing=args.update)
+    except KeyboardInterrupt:
+        db.rollback()
+        print("⏸️ 已中斷，之後可加上 --resume 從最後提交的區塊接續", file=sys.stderr)
+        return 130
+    finally:
+        db.close()
+
+    print(f"✅ 完成：{summary['rows']} 筆 (新增 {summary['inserted']}、更新 {summary['updated']}、"
+          f"拒絕 {summary['rejected']})，耗時 {summary['elapsed']:.2f} 秒", file=sys.stderr)
+    if args.table in ("professors", "locations"):
+        print("ℹ️ 後端若正在執行，請重新啟動以重建名冊/地點索引", file=sys.stderr)
+    return 0 if summary["rejected"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
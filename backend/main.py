@@ -1,32 +1,53 @@
 import os
 import json
 import difflib
-import requests
-import re
+import httpx
 import mimetypes
+import secrets
+import tempfile
 from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
 from contextlib import asynccontextmanager
+import anyio
+import anyio.to_thread
 
 # 確保 Office Open XML 格式有正確的 MIME 類型
-# 在某些 Linux 環境下 mimetypes 資料庫不完整，不補的話 StaticFiles 會回傳 text/plain
+# 在某些 Linux 環境下 mimetypes 資料庫不完整，不補的話下載的 FileResponse 會回傳 text/plain
 mimetypes.add_type("application/vnd.openxmlformats-officedocument.presentationml.presentation", ".pptx")
 mimetypes.add_type("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", ".xlsx")
 mimetypes.add_type("application/vnd.openxmlformats-officedocument.wordprocessingml.document", ".docx")
 
-from fastapi import FastAPI, Depends, HTTPException, Header, Request
+from fastapi import FastAPI, Depends, HTTPException, Header, Path, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.background import BackgroundTask
 from pydantic import BaseModel, Field
 from sqlalchemy.orm import Session
 from dotenv import load_dotenv
 from typing import List, Optional
 
+# .env 必須在匯入本地模組前載入，services 內的調校參數在匯入時就會讀取環境變數
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENV_PATH = os.path.join(BASE_DIR, ".env")
+load_dotenv(ENV_PATH)
+
 import schemas 
 import models
-from database import engine, get_db
-from services.generator import generate_ppt
+from database import engine, get_db, SessionLocal, THREADPOOL_SIZE, advisory_lock
+from services.generator import generate_ppt, generate_deck, dedup_stats, ppt_filename, download_cache, start_process_pool, shutdown_process_pool, process_pool_stats
+from services.roster_index import get_roster_index
+from services.location_index import get_location_index, normalize_location_text
+from services.fts_search import setup_fts
+from services.committee_parser import split_members, parse_member, is_likely_person_name, parser_cache_stats
+from services.result_cache import TTLCache
+from services.announcement import format_defense_date, order_committee, build_defense_log, build_ppt_data, generate_batch, write_batch_zip, session_logs, build_ppt_data_from_log
+from services.dify_client import start_dify_client, close_dify_client, get_dify_client
+from services.chat_limiter import chat_limiter, ChatLimitError
+from services.render_queue import render_queue, QueueFullError, JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED
+from services.readiness import readiness
 from seed import run_seed
+from migrate import run_migrations
 
 # ==========================================
 # 請求格式定義 (Pydantic Models) - openapi.json 的核心
@@ -34,6 +55,7 @@ from seed import run_seed
 class ChatRequest(BaseModel):
     query: str
     conversation_id: str = ""   # 用來接前端傳來的記憶 ID
+    stream: bool = False        # true 時以 SSE 即時轉送回覆片段
 
 class ToolLocationRequest(BaseModel):
     keyword: str = Field(..., description="使用者輸入的地點關鍵字")
@@ -57,24 +79,63 @@ class ToolSubmitRequest(BaseModel):
     final_location: str = Field(..., description="驗證過後的完整地點名稱")
     final_committee_str: str = Field(..., description="驗證過後的委員名單，請用逗號分隔，例如：鄭瑞光 教授, 吳晉賢 副教授")
 
+class BatchGenerateRequest(BaseModel):
+    items: List[ToolSubmitRequest] = Field(..., description="多位學生的 submit_and_generate 資料")
+    as_zip: bool = Field(False, description="是否直接回傳包含所有 PPTX 與 manifest.json 的 zip 檔")
+
 # ==========================================
 # 初始化與伺服器設定
 # ==========================================
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("啟動中：正在檢查與初始化資料庫...")
-    models.Base.metadata.create_all(bind=engine)
-    run_seed() 
+    # 同步 endpoint 的執行緒池大小，與 database.py 的連線池上限一致
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    # 資料表結構必須在接受連線前就緒；播種與索引暖身可視設定延後到背景進行
+    with advisory_lock("schema"):
+        models.Base.metadata.create_all(bind=engine)
+        run_migrations()
+    # 名冊與地點索引在播種完成後建立一次，之後資料異動時才會重建
+    warmup_steps = [
+        # 只有背景暖身會把播種失敗往外拋 (readiness 維持 503)；同步啟動照舊記錄後繼續啟動
+        ("seeding", lambda: run_seed(raise_errors=DEFERRED_STARTUP)),
+        ("fts", lambda: setup_fts(engine)),
+        ("roster_index", get_roster_index),
+        ("location_index", get_location_index),
+    ]
+    if DEFERRED_STARTUP:
+        readiness.start_background(warmup_steps)
+    else:
+        readiness.run(warmup_steps)
+    download_cache.load()
+    start_process_pool()
+    if PPT_GENERATION_MODE == "async":
+        render_queue.start()
+    start_dify_client()
     yield
     print("伺服器關閉中...")
-
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-ENV_PATH = os.path.join(BASE_DIR, ".env")
-load_dotenv(ENV_PATH)
+    await close_dify_client()
+    # 等待已排入的 PPT 生成工作完成再結束，最後才關閉渲染行程池
+    render_queue.shutdown(wait=True)
+    shutdown_process_pool(wait=True)
 
 # 因為您在 Linux VM 上，建議預設 IP 指向 VM 的實體 IP
 SERVER_URL = os.getenv("SERVER_URL", "http://127.0.0.1:8088")
 
+# PPT 生成模式：sync (預設，請求內直接渲染)、async (排入背景佇列，立即回傳 job_id)
+# 或 lazy (只存紀錄，第一次下載時才渲染)
+PPT_GENERATION_MODE = os.getenv("PPT_GENERATION_MODE", "sync").lower()
+
+# 延後啟動：true 時先開始接受連線，播種與索引暖身在背景進行 (就緒與否看 /api/v1/health/ready)
+DEFERRED_STARTUP = os.getenv("DEFERRED_STARTUP", "false").lower() == "true"
+
+# query_committee 結果快取：Dify 重試與多輪澄清常以相同學號、相同名單重複呼叫
+committee_cache = TTLCache(
+    max_size=int(os.getenv("COMMITTEE_CACHE_SIZE", "512")),
+    ttl_seconds=float(os.getenv("COMMITTEE_CACHE_TTL", "300")),
+    enabled=os.getenv("COMMITTEE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+)
+
 app = FastAPI(
     title="Defense-Bot API",
     lifespan=lifespan,
@@ -90,12 +151,25 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 生成的 PPT 檔名含 log_id，內容不會再變，可讓瀏覽器私有快取；
+# 預設 max-age=0 (每次仍帶 ETag 回來驗證身分，通常只拿到 304)，設定秒數後在期限內直接使用快取
+DOWNLOAD_CACHE_MAX_AGE = int(os.getenv("DOWNLOAD_CACHE_MAX_AGE", "0"))
+DOWNLOAD_PATH_PREFIX = "/api/v1/downloads/"
+
+
 @app.middleware("http")
 async def add_no_cache_to_api(request: Request, call_next):
     """對所有 /api/ 回應加上防快取標頭，
-    避免瀏覽器用快取的 200 回應繞過登入驗證。"""
+    避免瀏覽器用快取的 200 回應繞過登入驗證。
+    唯一例外是成功的 PPT 下載：允許私有快取，並依學號區分快取內容。"""
     response = await call_next(request)
-    if request.url.path.startswith("/api/"):
+    if request.url.path.startswith(DOWNLOAD_PATH_PREFIX) and response.status_code in (200, 206, 304):
+        if DOWNLOAD_CACHE_MAX_AGE > 0:
+            response.headers["Cache-Control"] = f"private, max-age={DOWNLOAD_CACHE_MAX_AGE}, immutable"
+        else:
+            response.headers["Cache-Control"] = "private, no-cache"
+        response.headers["Vary"] = "X-Student-Id"
+    elif request.url.path.startswith("/api/"):
         response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate"
         response.headers["Pragma"] = "no-cache"
     return response
@@ -109,12 +183,38 @@ def get_current_student_id(x_student_id: str = Header(None, description="模擬
         raise HTTPException(status_code=401, detail="未登入或缺乏身份憑證")
     return x_student_id
 
+# 系辦批次 API 會回傳所有學生的佈告內容，必須以管理金鑰呼叫；未設定金鑰時整組 API 停用
+ADMIN_API_KEY = os.getenv("ADMIN_API_KEY", "")
+
+def require_admin(x_admin_key: str = Header(None, description="系辦批次 API 的管理金鑰 (ADMIN_API_KEY)")):
+    if not ADMIN_API_KEY:
+        raise HTTPException(status_code=403, detail="後端未設定 ADMIN_API_KEY，批次 API 已停用")
+    if not x_admin_key or not secrets.compare_digest(x_admin_key.encode("utf-8"), ADMIN_API_KEY.encode("utf-8")):
+        raise HTTPException(status_code=401, detail="管理金鑰錯誤或未提供")
+
 # ==========================================
 #  需認證的檔案下載 API（取代原本的 StaticFiles）
 # ==========================================
+def is_not_modified(request: Request, etag: str, mtime: float) -> bool:
+    """依 If-None-Match / If-Modified-Since 判斷瀏覽器的快取是否仍有效 (If-None-Match 優先)"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
 @app.get("/api/v1/downloads/{filename}")
 def authenticated_download(
     filename: str,
+    request: Request,
     student_id: str = Depends(get_current_student_id),
     db: Session = Depends(get_db)
 ):
@@ -123,32 +223,69 @@ def authenticated_download(
     if "/" in filename or "\\" in filename or ".." in filename:
         raise HTTPException(status_code=400, detail="無效的檔案名稱")
 
-    # 查詢此學生的所有紀錄，只比對檔名部分，相容舊格式（http://...）與新格式（/api/v1/...）
-    logs = db.query(models.DefenseLog).filter(
-        models.DefenseLog.student_id == student_id
-    ).all()
-
-    log = None
-    for l in logs:
-        stored_url = (l.generated_file_url or '').strip()
-        # 取出 URL 最後一段作為檔名比對
-        stored_filename = stored_url.rstrip('/').split('/')[-1]
-        if stored_filename == filename:
-            log = l
-            break
+    # 以索引欄位直接比對檔名 (舊格式的 URL 已在遷移時回填成檔名)
+    log = db.query(models.DefenseLog).filter(
+        models.DefenseLog.student_id == student_id,
+        models.DefenseLog.generated_filename == filename
+    ).first()
 
     if not log:
         raise HTTPException(status_code=403, detail="無權限存取此檔案")
 
     file_path = os.path.join(DOWNLOAD_DIR, filename)
-    if not os.path.isfile(file_path):
-        raise HTTPException(status_code=404, detail="檔案不存在")
+    regenerable = filename == ppt_filename(log.student_id, log.log_id) and log.student is not None
+    # 回應送完前檔案保持 pin，其他請求觸發的磁碟快取淘汰不會刪掉它
+    download_cache.pin(file_path)
+    handed_off = False
+    try:
+        if os.path.isfile(file_path):
+            download_cache.touch(filename)
+        elif regenerable:
+            # 延遲生成模式的第一次下載，或檔案已被磁碟快取淘汰：依紀錄內容重新渲染
+            generate_ppt(build_ppt_data_from_log(log), log.log_id)
+        else:
+            raise HTTPException(status_code=404, detail="檔案不存在")
+
+        # 強 ETag (Range 搭配 If-Range 時需要)；驗證完身分才回 304，快取不會繞過授權
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            # 檢查後才被刪除 (例如共用下載目錄的其他行程淘汰了它)：能重建就再渲染一次
+            if not regenerable:
+                raise HTTPException(status_code=404, detail="檔案不存在")
+            generate_ppt(build_ppt_data_from_log(log), log.log_id)
+            stat = os.stat(file_path)
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        if is_not_modified(request, etag, stat.st_mtime):
+            return Response(status_code=304, headers={"ETag": etag, "Last-Modified": formatdate(stat.st_mtime, usegmt=True)})
+
+        # FileResponse 會自行處理 Range / If-Range，回傳 206 部分內容
+        handed_off = True
+        return PinnedFileResponse(
+            file_path,
+            filename=filename,
+            media_type="application/vnd.openxmlformats-officedocument.presentationml.presentation",
+            headers={"ETag": etag},
+            stat_result=stat
+        )
+    finally:
+        if not handed_off:
+            download_cache.unpin(file_path)
 
-    return FileResponse(
-        file_path,
-        filename=filename,
-        media_type="application/vnd.openxmlformats-officedocument.presentationml.presentation"
-    )
+
+class PinnedFileResponse(FileResponse):
+    """
+    回應結束 (送完、前端斷線或根本沒開始送) 時才解除下載檔案的 pin；
+    background 在前端斷線時不會執行，不能用來解除 pin
+    """
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # unpin 可能順便淘汰檔案 (刪檔)，丟到執行緒池避免卡住事件迴圈
+            with anyio.CancelScope(shield=True):
+                await run_in_threadpool(download_cache.unpin, self.path)
 
 # ==========================================
 # 前端專用 API (首頁與歷史紀錄保持不變)
@@ -157,6 +294,33 @@ def authenticated_download(
 def root():
     return {"status": "running", "message": "Defense-Bot Backend is up and running!"}
 
+@app.get("/api/v1/health/live")
+def liveness():
+    """行程存活即回 200，不碰資料庫"""
+    return {"status": "alive"}
+
+@app.get("/api/v1/health/ready")
+def readiness_probe():
+    """播種與索引暖身完成才回 200，之前 (或暖身失敗) 回 503"""
+    state = readiness.stats()
+    if not state["ready"]:
+        return JSONResponse(status_code=503, content=state, headers={"Retry-After": "5"})
+    return state
+
+@app.get("/api/v1/metrics")
+def get_metrics():
+    """後端內部快取與索引的運作統計，供維運觀察"""
+    return {
+        "member_parser_cache": parser_cache_stats(),
+        "committee_result_cache": committee_cache.stats(),
+        "render_queue": render_queue.stats(),
+        "render_processes": process_pool_stats(),
+        "ppt_dedup": dedup_stats(),
+        "chat_limiter": chat_limiter.stats(),
+        "download_cache": download_cache.stats(),
+        "startup": readiness.stats(),
+    }
+
 @app.get("/api/v1/students/me")
 def get_my_profile(student_id: str = Depends(get_current_student_id), db: Session = Depends(get_db)):
     student = db.query(models.Student).filter(models.Student.student_id == student_id).first()
@@ -206,19 +370,15 @@ def tool_query_location(payload: ToolLocationRequest, db: Session = Depends(get_
     """提供給 Agent 查詢地點，具備自動補全與伺服器端模糊糾錯功能"""
     keyword = payload.keyword
 
-    all_locations = db.query(models.DefenseLocation).all()
-    all_location_names = [loc.full_location_name for loc in all_locations]
+    # 熱路徑全部走記憶體索引，房號/全名皆已預先正規化
+    location_index = get_location_index(db)
+    all_location_names = location_index.names
 
-    # 正規化函式：移除連字號/全形連字號/空白，轉小寫
-    # 目的：讓「IB101」能精確比對到資料庫中的「IB-101」
-    def normalize(s: str) -> str:
-        return re.sub(r'[\s\-\u2010-\u2015\u2212\uFF0D]+', '', s).lower()
-
-    keyword_norm = normalize(keyword)
+    keyword_norm = normalize_location_text(keyword)
 
     # 第零關：以正規化房號做精確比對（最優先，處理省略連字號的輸入）
     # 例：「IB101」→ normalize → 「ib101」，比對 room_number「IB-101」→「ib101」→ 完全吻合
-    room_exact = [loc for loc in all_locations if normalize(loc.room_number) == keyword_norm]
+    room_exact = location_index.find_room(keyword_norm)
     if len(room_exact) == 1:
         return {"status": "success", "full_location_name": room_exact[0].full_location_name, "reference_locations": []}
 
@@ -226,20 +386,16 @@ def tool_query_location(payload: ToolLocationRequest, db: Session = Depends(get_
     if len(room_exact) > 1:
         scored_exact = sorted(
             room_exact,
-            key=lambda loc: difflib.SequenceMatcher(None, keyword_norm, normalize(loc.room_number)).ratio(),
+            key=lambda loc: difflib.SequenceMatcher(None, keyword_norm, loc.room_norm).ratio(),
             reverse=True
         )
         best, second = scored_exact[0], scored_exact[1]
-        if difflib.SequenceMatcher(None, keyword_norm, normalize(best.full_location_name)).ratio() > \
-           difflib.SequenceMatcher(None, keyword_norm, normalize(second.full_location_name)).ratio():
+        if difflib.SequenceMatcher(None, keyword_norm, best.name_norm).ratio() > \
+           difflib.SequenceMatcher(None, keyword_norm, second.name_norm).ratio():
             return {"status": "success", "full_location_name": best.full_location_name, "reference_locations": []}
 
-    # 第一關：SQL ilike 精確模糊比對（建號/房號/全名）
-    locations = db.query(models.DefenseLocation).filter(
-        (models.DefenseLocation.room_number.ilike(f"%{keyword}%")) |
-        (models.DefenseLocation.full_location_name.ilike(f"%{keyword}%")) |
-        (models.DefenseLocation.building_name.ilike(f"%{keyword}%"))
-    ).all()
+    # 第一關：子字串比對（建號/房號/全名，不分大小寫，取代 SQL ilike；啟用 FTS5 時走 trigram 索引）
+    locations = location_index.search(keyword, db)
 
     # 情況 1：精確命中一筆，直接補全
     if len(locations) == 1:
@@ -252,8 +408,8 @@ def tool_query_location(payload: ToolLocationRequest, db: Session = Depends(get_
     # 情況 2：找到多筆，以正規化房號相似度排序（房號優先，全名次之）
     if len(locations) > 1:
         def similarity(loc):
-            room_score = difflib.SequenceMatcher(None, keyword_norm, normalize(loc.room_number)).ratio()
-            name_score = difflib.SequenceMatcher(None, keyword_norm, normalize(loc.full_location_name)).ratio()
+            room_score = difflib.SequenceMatcher(None, keyword_norm, loc.room_norm).ratio()
+            name_score = difflib.SequenceMatcher(None, keyword_norm, loc.name_norm).ratio()
             return room_score * 0.7 + name_score * 0.3
 
         scored = sorted(
@@ -293,8 +449,10 @@ def tool_query_location(payload: ToolLocationRequest, db: Session = Depends(get_
 
     # 情況 4：difflib 找到多個近似結果，先以分數排序，若最佳明顯勝出就直接補全
     if len(close_matches) > 1:
+        keyword_lower = keyword.lower()
+
         def diff_score(name):
-            return difflib.SequenceMatcher(None, keyword.lower(), name.lower()).ratio()
+            return difflib.SequenceMatcher(None, keyword_lower, location_index.lower_by_name[name]).ratio()
 
         scored_diff = sorted(
             [(name, diff_score(name)) for name in close_matches],
@@ -332,159 +490,19 @@ def tool_query_committee(payload: ToolCommitteeRequest, db: Session = Depends(ge
     if not student:
         return {"status": "error", "message": "查無此學生資料"}
 
-    def split_members(raw_members_text: str):
-        text = (raw_members_text or "").strip()
-        if not text:
-            return []
-
-        # 先統一常見分隔符
-        text = re.sub(r"[，、,;；/｜|\n\t]+", ",", text)
-        chunks = [chunk.strip() for chunk in text.split(",") if chunk.strip()]
-
-        title_or_org_hints = [
-            "講座教授", "特聘教授", "助理教授", "副教授", "教授", "博士",
-            "系", "所", "公司", "院", "中心", "處", "局", "部", "大學", "學院", "研究室", "實驗室", "科大"
-        ]
-
-        members = []
-        for chunk in chunks:
-            # 僅在「看起來是多個純中文姓名」時，才用空白再切一次
-            if (
-                " " in chunk
-                and not re.search(r"[A-Za-z]", chunk)
-                and not re.search(r"[()（）\[\]{}【】]", chunk)
-                and not any(hint in chunk for hint in title_or_org_hints)
-            ):
-                spaced_parts = [part.strip() for part in re.split(r"\s+", chunk) if part.strip()]
-                if spaced_parts and all(re.fullmatch(r"[\u4e00-\u9fff]{2,4}", p) for p in spaced_parts):
-                    members.extend(spaced_parts)
-                    continue
-
-            members.append(chunk)
-
-        return members
-
     members_list = split_members(payload.members)
 
-    all_profs = db.query(models.Professor).all()
-    prof_names = [p.professor_name for p in all_profs]
-    prof_dict = {p.professor_name: p for p in all_profs}
-
-    title_keywords = ["講座教授", "特聘教授", "助理教授", "副教授", "教授", "博士"]
-    org_keywords = ["系", "所", "公司", "院", "中心", "處", "局", "部", "大學", "學院", "研究室", "實驗室", "科大"]
-
-    def normalize_member_text(s: str) -> str:
-        return re.sub(r"\s+", "", s or "")
-
-    def normalize_org_text(s: str) -> str:
-        org = (s or "").strip()
-        org = re.sub(r"^[\s:：,，、\-—]+|[\s:：,，、\-—]+$", "", org)
-
-        # 去除最外層括號，避免輸出時組成 ((單位))
-        while org and re.match(r"^[\(\[（【].*[\)\]）】]$", org):
-            stripped = re.sub(r"^[\(\[（【]\s*", "", org)
-            stripped = re.sub(r"\s*[\)\]）】]$", "", stripped)
-            stripped = stripped.strip()
-            if stripped == org:
-                break
-            org = stripped
-
-        return org
-
-    def parse_member(raw_text: str):
-        text = raw_text.strip()
-        detected_title = ""
-        for title in title_keywords:
-            if title in text:
-                detected_title = title
-                break
-
-        has_org_hint = any(k in text for k in org_keywords)
-
-        name_candidate = text
-        org_candidate = text
-
-        # 先嘗試「姓名 + 職稱」模式，避免把姓名與單位黏在一起
-        if detected_title:
-            m = re.search(rf"([\u4e00-\u9fff]{{2,4}})\s*{detected_title}", text)
-            if m:
-                name_candidate = m.group(1)
-                org_candidate = text.replace(m.group(0), "", 1)
-
-        if name_candidate == text:
-            for title in title_keywords:
-                name_candidate = name_candidate.replace(title, "")
-            name_candidate = re.sub(r"[()（）\[\]{}【】]", "", name_candidate)
-            name_candidate = re.sub(r"\s+", "", name_candidate)
-            name_candidate = re.sub(r"[^\u4e00-\u9fffA-Za-z]", "", name_candidate)
-
-            org_candidate = text
-            if name_candidate:
-                org_candidate = org_candidate.replace(name_candidate, "")
-            if detected_title:
-                org_candidate = org_candidate.replace(detected_title, "")
-
-        org_candidate = normalize_org_text(org_candidate)
-
-        return {
-            "raw": text,
-            "clean_name": name_candidate,
-            "detected_title": detected_title,
-            "has_org_hint": has_org_hint,
-            "org_candidate": org_candidate
-        }
-
-    def chinese_name_similarity(input_name: str, prof_name: str) -> float:
-        a = normalize_member_text(input_name)
-        b = normalize_member_text(prof_name)
-        if not a or not b:
-            return 0.0
+    roster = get_roster_index(db)
+    prof_dict = roster.by_name
 
-        seq_score = difflib.SequenceMatcher(None, a, b).ratio()
-
-        set_a = set(a)
-        set_b = set(b)
-        overlap_score = len(set_a & set_b) / max(1, len(set_a | set_b))
-
-        # 通用 n-gram 重疊，避免硬編碼特定姓名或字形規則
-        def ngrams(s: str, n: int = 2):
-            if len(s) < n:
-                return {s} if s else set()
-            return {s[i:i+n] for i in range(len(s) - n + 1)}
-
-        ngram_a = ngrams(a, 2)
-        ngram_b = ngrams(b, 2)
-        ngram_score = len(ngram_a & ngram_b) / max(1, len(ngram_a | ngram_b))
-
-        max_len = max(len(a), len(b))
-        position_acc = 0.0
-        for idx in range(min(len(a), len(b))):
-            if a[idx] == b[idx]:
-                position_acc += 1.0
-        position_score = position_acc / max(1, max_len)
-
-        return seq_score * 0.35 + overlap_score * 0.2 + ngram_score * 0.2 + position_score * 0.25
-
-    def get_prof_candidates(clean_name: str):
-        scored = sorted(
-            [(name, chinese_name_similarity(clean_name, name)) for name in prof_names],
-            key=lambda x: x[1],
-            reverse=True
-        )
-        return scored[:3]
-
-    def get_best_difflib_score(clean_name: str):
-        if not clean_name:
-            return "", 0.0
-        scored = sorted(
-            [(name, difflib.SequenceMatcher(None, normalize_member_text(clean_name), normalize_member_text(name)).ratio()) for name in prof_names],
-            key=lambda x: x[1],
-            reverse=True
-        )
-        return scored[0] if scored else ("", 0.0)
+    # 快取鍵含指導教授與名冊版本：教授資料或學生指導教授一變動，舊結果自然不再命中
+    cache_key = (student.student_id, student.advisor_id, tuple(members_list), roster.version)
+    cached = committee_cache.get(cache_key)
+    if cached is not None:
+        return cached
 
     #  準備一份完整的教授名冊，等一下要當作參考書丟給 LLM
-    reference_roster = [f"{p.professor_name} {p.professor_title} ({p.department_name})" for p in all_profs]
+    reference_roster = roster.reference_roster
 
     final_committee = []
     unmatched = []
@@ -535,10 +553,9 @@ def tool_query_committee(payload: ToolCommitteeRequest, db: Session = Depends(ge
                 final_committee.append(full_title)
             continue
 
-        candidates = get_prof_candidates(clean_name)
+        candidates, (best_difflib_name, best_difflib_score) = roster.match(clean_name)
         best_name, best_score = candidates[0]
         second_score = candidates[1][1] if len(candidates) > 1 else 0.0
-        best_difflib_name, best_difflib_score = get_best_difflib_score(clean_name)
 
         # 若已有職稱但缺單位，且 difflib 分數低，直接改走補資料流程，避免 LLM 再問使用者確認候選
         if best_difflib_score < 0.5:
@@ -590,8 +607,7 @@ def tool_query_committee(payload: ToolCommitteeRequest, db: Session = Depends(ge
             if item not in candidate_roster_lite:
                 candidate_roster_lite.append(item)
 
-        is_likely_person_name = re.fullmatch(r"[\u4e00-\u9fff]{2,4}", clean_name) is not None
-        if is_likely_person_name and not confident_candidates and raw_name not in needs_manual_profile:
+        if is_likely_person_name(clean_name) and not confident_candidates and raw_name not in needs_manual_profile:
             needs_manual_profile.append(raw_name)
             missing_fields = []
             if not detected_title:
@@ -617,7 +633,7 @@ def tool_query_committee(payload: ToolCommitteeRequest, db: Session = Depends(ge
     # 固定同時回傳兩種名冊：精簡候選（reference_roster_lite）+ 完整全名冊（reference_roster）
     return_reference_roster = reference_roster
 
-    return {
+    result = {
         "status": "success",
         "final_committee": final_committee,  
         "unmatched_names": unmatched,
@@ -636,71 +652,56 @@ def tool_query_committee(payload: ToolCommitteeRequest, db: Session = Depends(ge
         "is_valid_count": len(final_committee) >= 3,
         "current_count": len(final_committee)
     }
+    committee_cache.put(cache_key, result)
+    return result
 
 
 @app.post("/api/v1/tool/submit_and_generate", summary="Tool 3: 最終儲存並生成 PPT")
 def tool_submit_and_generate(payload: ToolSubmitRequest, db: Session = Depends(get_db)):
-    """Agent 確認所有資料無誤後，一次性寫入資料庫並產出 PPT"""
+    """
+    Agent 確認所有資料無誤後，一次性寫入資料庫並產出 PPT。
+    回傳 status=success 時附 download_url；伺服器啟用背景生成時回傳 status=queued 與 job_id，需再以 Tool 4 查詢 download_url。
+    """
     student = db.query(models.Student).filter(models.Student.student_id == payload.student_id).first()
     if not student:
         return {"status": "error", "message": "查無此學生資料"}
         
-    raw_committee = re.split(r'[，、,]+', payload.final_committee_str)
-    final_committee_list = [m.strip() for m in raw_committee if m.strip()]
-
-    # 最終防線：無論 LLM 傳入的順序為何，強制確保指導教授排在委員名單最末位
-    if student.advisor:
-        advisor_full_submit = f"{student.advisor.professor_name} {student.advisor.professor_title} ({student.advisor.department_name})"
-        # 尋找名單中是否有包含指導教授姓名的項目（容錯：格式可能略有不同）
-        advisor_idx = next(
-            (i for i, m in enumerate(final_committee_list)
-             if student.advisor.professor_name in m),
-            None
-        )
-        if advisor_idx is not None:
-            # 已存在：移到最後
-            final_committee_list.append(final_committee_list.pop(advisor_idx))
-        else:
-            # 不存在：補入最後（以資料庫標準格式）
-            final_committee_list.append(advisor_full_submit)
+    formatted_date = format_defense_date(payload.defense_date)
+    final_committee_list = order_committee(student, payload.final_committee_str)
 
-    try:
-        dt = datetime.strptime(payload.defense_date, "%Y-%m-%d")
-        roc_year = dt.year - 1911
-        weekdays = ["一", "二", "三", "四", "五", "六", "日"]
-        formatted_date = f"民國{roc_year}年{dt.month}月{dt.day}日(星期{weekdays[dt.weekday()]})"
-    except ValueError:
-        formatted_date = payload.defense_date 
-
-    new_log = models.DefenseLog(
-        student_id=student.student_id,
-        defense_date_text=formatted_date,
-        defense_time_text=payload.defense_time,
-        location_full_text=payload.final_location,
-        committee_json=json.dumps(final_committee_list, ensure_ascii=False)
-    )
+    new_log = build_defense_log(student, payload, formatted_date, final_committee_list)
     db.add(new_log)
     db.commit()
 
-    advisor_full = f"{student.advisor.professor_name} {student.advisor.professor_title} {student.advisor.department_name}" if student.advisor else ""
-    full_data = schemas.FullPPTData(
-        student_id=student.student_id,
-        student_name=student.student_name,
-        thesis_title_zh=student.thesis_title_zh,
-        thesis_title_en=student.thesis_title_en,
-        advisor_full_text=advisor_full,
-        defense_date_text=formatted_date,
-        defense_time_text=payload.defense_time,
-        location_full_text=payload.final_location,
-        committee_members=final_committee_list
-    )
+    full_data = build_ppt_data(student, payload, formatted_date, final_committee_list)
 
-    filename = generate_ppt(full_data, new_log.log_id)
-    # 使用需認證的 API 路徑，確保只有本人能下載
-    download_url = f"/api/v1/downloads/{filename}"
-    
-    new_log.generated_file_url = download_url
-    db.commit()
+    # 延遲生成模式：只記下檔名，第一次下載時才依紀錄渲染，Agent 不必等待生成
+    if PPT_GENERATION_MODE == "lazy":
+        filename = ppt_filename(student.student_id, new_log.log_id)
+        new_log.generated_file_url = f"/api/v1/downloads/{filename}"
+        new_log.generated_filename = filename
+        db.commit()
+        # 此時尚未渲染，訊息不能說已生成，免得 Agent 與使用者誤會
+        return {
+            "status": "success",
+            "message": "口試資料已儲存！PPT 佈告會在第一次點擊下載連結時生成，請稍候幾秒即可下載。",
+            "download_url": new_log.generated_file_url
+        }
+
+    # 非同步模式：只排入背景佇列，立即回傳 job_id，不佔用請求執行緒渲染
+    if PPT_GENERATION_MODE == "async":
+        try:
+            job_id = render_queue.submit(render_and_attach, new_log.log_id, full_data, log_id=new_log.log_id)
+            return {
+                "status": "queued",
+                "message": "PPT 佈告已排入生成佇列，請以 job_id 查詢生成進度。",
+                "job_id": job_id,
+                "status_url": f"/api/v1/tool/generation_status/{job_id}"
+            }
+        except QueueFullError:
+            print("⚠️ PPT 生成佇列已滿，改為同步生成")
+
+    download_url = render_and_attach(new_log.log_id, full_data, db)["download_url"]
 
     return {
         "status": "success",
@@ -708,20 +709,123 @@ def tool_submit_and_generate(payload: ToolSubmitRequest, db: Session = Depends(g
         "download_url": download_url
     }
 
+
+def render_and_attach(log_id: int, full_data: schemas.FullPPTData, db: Session = None):
+    """生成 PPT 並把下載路徑寫回 DefenseLog；背景工作沒有請求的 Session，會自行開一個"""
+    filename = generate_ppt(full_data, log_id)
+    # 使用需認證的 API 路徑，確保只有本人能下載
+    download_url = f"/api/v1/downloads/{filename}"
+
+    owns_session = db is None
+    if owns_session:
+        db = SessionLocal()
+    try:
+        log = db.query(models.DefenseLog).filter(models.DefenseLog.log_id == log_id).first()
+        log.generated_file_url = download_url
+        log.generated_filename = filename
+        db.commit()
+    finally:
+        if owns_session:
+            db.close()
+
+    return {"download_url": download_url}
+
+
+@app.get("/api/v1/tool/generation_status/{job_id}", summary="Tool 4: 查詢 PPT 生成進度")
+def tool_generation_status(job_id: str = Path(..., description="submit_and_generate 回傳 status=queued 時附帶的 job_id")):
+    """
+    非同步生成模式下，查詢 submit_and_generate 回傳之 job_id 的生成狀態。
+    status 為 queued / running 時稍後再查；done 時回傳 download_url；failed 或 error 代表生成失敗或查無此工作。
+    """
+    job = render_queue.get(job_id)
+    if not job:
+        return {"status": "error", "message": "查無此生成工作，可能已過期或伺服器已重啟，請改至歷史紀錄查看。"}
+
+    messages = {
+        JOB_QUEUED: "排隊等待生成中，請稍候再查詢。",
+        JOB_RUNNING: "PPT 生成中，請稍候再查詢。",
+        JOB_DONE: "PPT 佈告已順利生成！",
+        JOB_FAILED: "PPT 生成失敗，請稍後重新送出。",
+    }
+    return {
+        "status": job["status"],
+        "job_id": job_id,
+        "log_id": job.get("log_id"),
+        "message": messages[job["status"]],
+        "download_url": job.get("download_url")
+    }
+
+# ==========================================
+# 系辦批次生成 (整個口試週一次產出)
+# ==========================================
+@app.post("/api/v1/batch/generate", summary="批次生成口試佈告", dependencies=[Depends(require_admin)])
+def batch_generate(payload: BatchGenerateRequest, db: Session = Depends(get_db)):
+    """一次處理多位學生：單次查詢驗證學號、單一交易寫入紀錄、平行渲染 PPT，回傳 manifest (或 zip)"""
+    if not payload.as_zip:
+        return generate_batch(db, payload.items)
+
+    # 產出的檔案在打包完成前保持 pin，不會被磁碟快取淘汰
+    pinned = []
+    try:
+        manifest = generate_batch(db, payload.items, pinned=pinned)
+        # PPTX 動輒數 MB，先寫到暫存檔再串流回傳，避免整包留在記憶體
+        tmp = tempfile.NamedTemporaryFile(suffix=".zip", delete=False)
+        try:
+            with tmp:
+                write_batch_zip(db, manifest, tmp)
+        except BaseException:
+            # 打包失敗時不會有回應來刪除暫存檔，要在這裡清掉
+            os.remove(tmp.name)
+            raise
+    finally:
+        download_cache.unpin(*pinned)
+    return FileResponse(
+        tmp.name,
+        filename=f"defense_batch_{datetime.now().strftime('%Y%m%d%H%M%S')}.zip",
+        media_type="application/zip",
+        background=BackgroundTask(os.remove, tmp.name)
+    )
+
+@app.get("/api/v1/batch/deck", summary="生成同一場次的合併簡報", dependencies=[Depends(require_admin)])
+def batch_deck(defense_date: Optional[str] = None, location: Optional[str] = None, db: Session = Depends(get_db)):
+    """依口試日期 (YYYY-MM-DD) 及/或地點，把該場次每位學生的佈告合成一份多張投影片的簡報，供現場投影"""
+    if not defense_date and not location:
+        raise HTTPException(status_code=400, detail="請至少指定 defense_date 或 location")
+
+    logs = session_logs(db, defense_date, location)
+    if not logs:
+        raise HTTPException(status_code=404, detail="查無符合條件的口試紀錄")
+
+    content = generate_deck([build_ppt_data_from_log(log) for log in logs])
+    filename = f"defense_deck_{datetime.now().strftime('%Y%m%d%H%M%S')}.pptx"
+    return Response(
+        content,
+        media_type="application/vnd.openxmlformats-officedocument.presentationml.presentation",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 # ==========================================
 # 前端對話代理 Proxy (傳遞對話至 Dify)
 # ==========================================
-@app.post("/api/v1/chat")
-def chat_proxy(payload: ChatRequest, student_id: str = Depends(get_current_student_id), db: Session = Depends(get_db)):
+CHAT_FALLBACK_ANSWER = "抱歉，管家剛才沒有聽清楚，或是系統連線稍有延遲，請您再說一次好嗎？"
+
+
+def build_dify_request(payload: ChatRequest, student_id: str):
+    """組出送往 Dify chat-messages 的 (URL, headers, body)"""
     DIFY_API_KEY = os.getenv("DIFY_API_KEY")
     DIFY_API_URL = os.getenv("DIFY_API_URL", "https://api.dify.ai/v1/chat-messages")
 
     if not DIFY_API_KEY:
         raise HTTPException(status_code=500, detail="後端未設定 Dify API Key")
 
-    student = db.query(models.Student).filter(models.Student.student_id == student_id).first()
-    student_name = student.student_name if student else "同學"
-    thesis_title = student.thesis_title_zh if student else "尚未設定題目"
+    # 自己開短暫的 Session，查完立即歸還連線；對話可能持續數十秒，不能一路佔著連線池
+    db = SessionLocal()
+    try:
+        student = db.query(models.Student).filter(models.Student.student_id == student_id).first()
+        student_name = student.student_name if student else "同學"
+        thesis_title = student.thesis_title_zh if student else "尚未設定題目"
+    finally:
+        db.close()
 
     dify_payload = {
         "inputs": {
@@ -742,40 +846,153 @@ def chat_proxy(payload: ChatRequest, student_id: str = Depends(get_current_stude
         "Authorization": f"Bearer {DIFY_API_KEY}",
         "Content-Type": "application/json"
     }
+    return DIFY_API_URL, headers, dify_payload
+
+
+async def iter_dify_events(lines):
+    """
+    逐行解析 Dify 的 SSE 串流，依序產出 (conversation_id, 回覆片段)。
+    conversation_id 一出現就會帶出 (片段可能是空字串)，之後每個回覆片段各產出一次。
+    """
+    conv_id = ""
+    async for line_str in lines:
+        if not line_str or not line_str.startswith("data: "):
+            continue
+        try:
+            data = json.loads(line_str[6:]) 
+        except json.JSONDecodeError:
+            continue
+
+        delta = ""
+        if data.get("event") in ["agent_message", "message"]:
+            delta = data.get("answer", "")
+        elif data.get("event") == "error":
+            delta = f"\n[管家系統提示：{data.get('message', '遭遇未知錯誤')}]"
 
+        new_conv = "conversation_id" in data and not conv_id
+        if new_conv:
+            conv_id = data["conversation_id"]
+        if delta or new_conv:
+            yield conv_id, delta
+
+
+def sse_event(data: dict) -> str:
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/api/v1/chat")
+async def chat_proxy(payload: ChatRequest, student_id: str = Depends(get_current_student_id)):
+    # 先取得對話名額：整體或該學生已滿時直接回 503/429，不讓請求堆積到 Dify
+    try:
+        slot = await chat_limiter.acquire(student_id)
+    except ChatLimitError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message, headers={"Retry-After": str(e.retry_after)})
+
+    streaming = False
     try:
-        response = requests.post(DIFY_API_URL, json=dify_payload, headers=headers, stream=True)
+        # 資料庫查詢是同步的，丟到執行緒池避免卡住事件迴圈
+        dify_url, headers, dify_payload = await run_in_threadpool(build_dify_request, payload, student_id)
+
+        client = get_dify_client()
+        try:
+            request = client.build_request("POST", dify_url, json=dify_payload, headers=headers)
+            response = await client.send(request, stream=True)
+        except httpx.HTTPError as e:
+            raise HTTPException(status_code=500, detail="無法連線至 AI 伺服器")
+        # 之後不論從哪裡離開，歸還名額時都會一併關閉上游回應
+        slot.attach(response)
+
         if response.status_code != 200:
-            raise HTTPException(status_code=500, detail=f"Dify 拒絕請求: {response.text}")
-            
+            detail = (await response.aread()).decode("utf-8", errors="replace")
+            raise HTTPException(status_code=500, detail=f"Dify 拒絕請求: {detail}")
+
+        if payload.stream:
+            # 串流模式的名額交給回應物件，在串流結束、前端斷線或根本沒開始送出時歸還
+            streaming = True
+            return ChatStreamingResponse(
+                stream_chat_events(response, slot),
+                slot=slot,
+                media_type="text/event-stream",
+                # 告知 nginx 等反向代理不要緩衝，片段才能即時送達瀏覽器
+                headers={"X-Accel-Buffering": "no"},
+            )
+
+        return await collect_chat_answer(response)
+    finally:
+        if not streaming:
+            with anyio.CancelScope(shield=True):
+                await slot.release()
+
+
+class ChatStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse 的 background 在前端斷線 (ClientDisconnect) 時不會執行，
+    產生器若還沒開始跑，它的 finally 也不會執行；改在 __call__ 結束時一定歸還名額並關閉上游回應。
+    """
+
+    def __init__(self, content, slot, **kwargs):
+        super().__init__(content, **kwargs)
+        self.slot = slot
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # 被取消時仍要把關閉上游連線做完，否則連線會留在 Dify 連線池裡
+            with anyio.CancelScope(shield=True):
+                await self.slot.release()
+
+
+async def collect_chat_answer(response):
+    try:
         final_answer = ""
         conv_id = "" 
-        
-        for line in response.iter_lines():
-            if line:
-                line_str = line.decode('utf-8')
-                if line_str.startswith("data: "):
-                    try:
-                        data = json.loads(line_str[6:]) 
-                        
-                        if data.get("event") in ["agent_message", "message"]:
-                            final_answer += data.get("answer", "")
-                        
-                        elif data.get("event") == "error":
-                            final_answer += f"\n[管家系統提示：{data.get('message', '遭遇未知錯誤')}]"
-                        
-                        if "conversation_id" in data and not conv_id:
-                            conv_id = data["conversation_id"]
-                    except json.JSONDecodeError:
-                        continue
+        async for conv_id, delta in iter_dify_events(response.aiter_lines()):
+            final_answer += delta
         
         if not final_answer.strip():
-            final_answer = "抱歉，管家剛才沒有聽清楚，或是系統連線稍有延遲，請您再說一次好嗎？"
+            final_answer = CHAT_FALLBACK_ANSWER
 
         return {
             "answer": final_answer,
             "conversation_id": conv_id 
         }
 
-    except requests.exceptions.RequestException as e:
-        raise HTTPException(status_code=500, detail="無法連線至 AI 伺服器")
\ No newline at end of file
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=500, detail="無法連線至 AI 伺服器")
+    finally:
+        await response.aclose()
+
+
+async def stream_chat_events(response, slot=None):
+    """
+    把 Dify 的回覆片段即時轉成 SSE 送給前端：
+    第一個事件 (start) 帶 conversation_id，之後每個片段一個 delta 事件，最後以 end 事件附上完整回答。
+    """
+    final_answer = ""
+    conv_id = ""
+    started = False
+    try:
+        async for conv_id, delta in iter_dify_events(response.aiter_lines()):
+            if not started:
+                started = True
+                yield sse_event({"event": "start", "conversation_id": conv_id})
+            if delta:
+                final_answer += delta
+                yield sse_event({"event": "delta", "answer": delta})
+    except httpx.HTTPError:
+        error_text = "\n[管家系統提示：與 AI 伺服器的連線中斷]"
+        final_answer += error_text
+        yield sse_event({"event": "delta", "answer": error_text})
+    finally:
+        if slot is not None:
+            await slot.release()
+        else:
+            await response.aclose()
+
+    if not started:
+        yield sse_event({"event": "start", "conversation_id": conv_id})
+    if not final_answer.strip():
+        final_answer = CHAT_FALLBACK_ANSWER
+        yield sse_event({"event": "delta", "answer": final_answer})
+    yield sse_event({"event": "end", "conversation_id": conv_id, "answer": final_answer})
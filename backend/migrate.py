@@ -0,0 +1,48 @@
+from sqlalchemy import inspect, text
+import models
+from database import engine
+
+# ==========================================
+# 輕量資料庫遷移 (create_all 只會建新表，不會替既有資料表補欄位)
+# 每個步驟都是冪等的，開機時重複執行也安全
+# ==========================================
+
+
+def filename_from_url(url: str) -> str:
+    """
+    取出下載路徑的檔名，相容所有曾經存過的格式：
+    http(s)://主機/downloads/xxx、/downloads/xxx 與 /api/v1/downloads/xxx
+    """
+    return (url or "").strip().rstrip("/").split("/")[-1]
+
+
+def _add_generated_filename(conn):
+    columns = {col["name"] for col in inspect(conn).get_columns("defense_logs")}
+    if "generated_filename" not in columns:
+        conn.execute(text("ALTER TABLE defense_logs ADD COLUMN generated_filename VARCHAR"))
+        print("🛠️ defense_logs 新增欄位 generated_filename")
+
+    indexes = {idx["name"] for idx in inspect(conn).get_indexes("defense_logs")}
+    if "ix_defense_logs_generated_filename" not in indexes:
+        conn.execute(text("CREATE INDEX ix_defense_logs_generated_filename ON defense_logs (generated_filename)"))
+
+    # 回填：舊紀錄只有 generated_file_url，一次算好檔名寫回
+    rows = conn.execute(text(
+        "SELECT log_id, generated_file_url FROM defense_logs "
+        "WHERE generated_filename IS NULL AND generated_file_url IS NOT NULL AND generated_file_url != ''"
+    )).all()
+    updates = [{"log_id": log_id, "filename": filename_from_url(url)} for log_id, url in rows]
+    if updates:
+        conn.execute(text("UPDATE defense_logs SET generated_filename = :filename WHERE log_id = :log_id"), updates)
+        print(f"🛠️ 已回填 {len(updates)} 筆下載檔名")
+
+
+def run_migrations():
+    with engine.begin() as conn:
+        _add_generated_filename(conn)
+
+
+# 單獨執行用
+if __name__ == "__main__":
+    models.Base.metadata.create_all(bind=engine)
+    run_migrations()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, DateTime
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from database import Base
@@ -59,7 +59,33 @@ class DefenseLog(Base):
     defense_time_text = Column(String, nullable=False)
     committee_json = Column(String, nullable=False) # 陣列存成 JSON 字串
     generated_file_url = Column(String)
+    # 下載路徑的檔名部分，下載授權時以索引直接比對 (舊資料由 migrate.py 回填)
+    generated_filename = Column(String, index=True)
 
     # 關聯
     student = relationship("Student", back_populates="defense_logs")
-    location = relationship("DefenseLocation", back_populates="defense_logs")
\ No newline at end of file
+    location = relationship("DefenseLocation", back_populates="defense_logs")
+
+class SeedState(Base):
+    __tablename__ = "seed_state"
+
+    # 每份種子 CSV 上次成功匯入時的內容雜湊，內容沒變就整張表略過
+    table_name = Column(String, primary_key=True)
+    content_sha256 = Column(String, nullable=False)
+    row_count = Column(Integer, nullable=False, default=0)
+    seeded_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class ImportProgress(Base):
+    __tablename__ = "import_progress"
+
+    # import_csv.py 的斷點：與每個區塊的資料在同一筆交易中提交，中斷後可從最後提交的區塊接續
+    table_name = Column(String, primary_key=True)
+    source_path = Column(String, primary_key=True)
+    content_sha256 = Column(String, nullable=False)
+    rows_done = Column(Integer, nullable=False, default=0)
+    rows_inserted = Column(Integer, nullable=False, default=0)
+    rows_updated = Column(Integer, nullable=False, default=0)
+    rows_rejected = Column(Integer, nullable=False, default=0)
+    finished = Column(Boolean, nullable=False, default=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -0,0 +1,206 @@
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+# 與 bulk_generate.py、import_csv.py 相同，以 backend/ 為根目錄匯入後端模組
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# ==========================================
+# 資料庫併發基準測試：歷史紀錄讀取 vs. 同時送出的口試資料寫入
+# 用法：
+#   python scripts/bench_db.py db [--seconds 10] [--readers 16] [--writers 8] [--extra-logs 20000]
+#     在暫存目錄建立全新的 SQLite (CSV 播種 + 額外的歷史紀錄，結束後刪除)，多執行緒直接呼叫
+#     /api/v1/defense/history 與 submit_and_generate 的 endpoint 函式 (延遲生成模式，不渲染 PPT)
+#   python scripts/bench_db.py http --url http://127.0.0.1:8088 [--seconds 10] [--readers 16] [--writers 4]
+#     對執行中的後端送出 HTTP 請求 (建議以 PPT_GENERATION_MODE=lazy 啟動，寫入端才只量到資料庫)
+# 比較調校前後時，以環境變數還原舊設定再跑一次 db 模式，例如：
+#   SQLITE_JOURNAL_MODE=DELETE SQLITE_SYNCHRONOUS=FULL SQLITE_MMAP_SIZE=0 SQLITE_CACHE_SIZE=-2000 \
+#   DB_POOL_SIZE=5 DB_MAX_OVERFLOW=10 python scripts/bench_db.py db
+# ==========================================
+
+COMMITTEE = "鄭瑞光 教授, 吳晉賢 副教授"
+LOCATION = "第二教學大樓 T2-202會議室"
+
+
+def submission(student_id: str, worker: int, n: int) -> dict:
+    # 每筆內容都不同，避免被去重或快取吸收
+    return {
+        "student_id": student_id,
+        "defense_date": f"2026-{1 + n % 12:02d}-{1 + worker % 28:02d}",
+        "defense_time": f"{9 + n % 8}:00",
+        "final_location": LOCATION,
+        "final_committee_str": f"{COMMITTEE}, 委員{worker}-{n} 教授",
+    }
+
+
+def percentile_ms(samples, p: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000
+
+
+def run_load(seconds: float, readers: int, writers: int, read_once, write_once):
+    """readers / writers 條執行緒各自反覆呼叫 read_once() / write_once(worker, n)，回傳各自的耗時清單與錯誤數"""
+    stop = time.monotonic() + seconds
+    reads, writes = [], []
+    errors = {"read": 0, "write": 0}
+    lock = threading.Lock()
+
+    def loop(kind, samples, call):
+        n = 0
+        while time.monotonic() < stop:
+            n += 1
+            started = time.perf_counter()
+            try:
+                call(n)
+            except Exception as e:
+                with lock:
+                    errors[kind] += 1
+                    if errors[kind] <= 3:
+                        print(f"⚠️ {kind} 失敗：{e}", file=sys.stderr)
+                continue
+            samples.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=loop, args=("read", reads, lambda n: read_once())) for _ in range(readers)]
+    threads += [
+        threading.Thread(target=loop, args=("write", writes, lambda n, w=w: write_once(w, n)))
+        for w in range(writers)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return reads, writes, errors
+
+
+def report(label: str, seconds: float, reads, writes, errors):
+    print(f"{label}")
+    print(f"  history 讀取 {len(reads) / seconds:8.1f} 次/秒  p50 {percentile_ms(reads, .5):7.1f} ms  "
+          f"p99 {percentile_ms(reads, .99):7.1f} ms  錯誤 {errors['read']}")
+    print(f"  submit 寫入  {len(writes) / seconds:8.1f} 次/秒  p50 {percentile_ms(writes, .5):7.1f} ms  "
+          f"p99 {percentile_ms(writes, .99):7.1f} ms  錯誤 {errors['write']}")
+
+
+def bench_db(args):
+    workdir = tempfile.mkdtemp(prefix="bench_db_")
+    # 資料庫引擎在匯入 database.py 時建立，必須先設定好環境變數
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["PPT_GENERATION_MODE"] = "lazy"
+
+    from sqlalchemy import insert, text
+
+    import main as api
+    import models
+    from database import SessionLocal, engine
+    from migrate import run_migrations
+    from seed import run_seed
+
+    models.Base.metadata.create_all(bind=engine)
+    run_migrations()
+    run_seed()
+
+    with SessionLocal() as db:
+        student_ids = [sid for (sid,) in db.query(models.Student.student_id)]
+    if not student_ids:
+        raise SystemExit("❌ 學生資料為空，請確認 data/students.csv")
+
+    if args.extra_logs:
+        # 模擬使用一段時間後的資料量：大部分紀錄屬於其他學號，讀取時才看得出索引與快取的差異
+        rng = random.Random(0)
+        rows = [{
+            "student_id": rng.choice(student_ids) if i % 1000 == 0 else f"S{i % 5000:05d}",
+            "defense_date_text": "民國115年3月4日(星期三)",
+            "defense_time_text": "14:00",
+            "location_full_text": LOCATION,
+            "committee_json": "[]",
+            "generated_file_url": f"/api/v1/downloads/bench_{i}.pptx",
+            "generated_filename": f"bench_{i}.pptx",
+        } for i in range(args.extra_logs)]
+        with engine.begin() as conn:
+            conn.execute(insert(models.DefenseLog), rows)
+
+    with engine.connect() as conn:
+        journal_mode = conn.execute(text("PRAGMA journal_mode")).scalar()
+
+    def read_once():
+        with SessionLocal() as db:
+            api.get_my_history(random.choice(student_ids), db)
+
+    def write_once(worker, n):
+        with SessionLocal() as db:
+            result = api.tool_submit_and_generate(
+                api.ToolSubmitRequest(**submission(random.choice(student_ids), worker, n)), db
+            )
+            if result["status"] != "success":
+                raise RuntimeError(result.get("message"))
+
+    try:
+        reads, writes, errors = run_load(args.seconds, args.readers, args.writers, read_once, write_once)
+    finally:
+        engine.dispose()
+        shutil.rmtree(workdir, ignore_errors=True)
+    report(f"📊 db 模式：journal_mode={journal_mode}，{args.readers} 讀 / {args.writers} 寫，{args.seconds:.0f} 秒，"
+           f"額外紀錄 {args.extra_logs} 筆", args.seconds, reads, writes, errors)
+
+
+def bench_http(args):
+    import httpx
+
+    local = threading.local()
+
+    def client():
+        if not hasattr(local, "client"):
+            local.client = httpx.Client(base_url=args.url, timeout=60)
+        return local.client
+
+    student_ids = args.student_ids.split(",")
+
+    def read_once():
+        r = client().get("/api/v1/defense/history", headers={"x-student-id": random.choice(student_ids)})
+        r.raise_for_status()
+
+    def write_once(worker, n):
+        r = client().post("/api/v1/tool/submit_and_generate", json=submission(random.choice(student_ids), worker, n))
+        r.raise_for_status()
+        if r.json().get("status") not in ("success", "queued"):
+            raise RuntimeError(r.text[:200])
+
+    reads, writes, errors = run_load(args.seconds, args.readers, args.writers, read_once, write_once)
+    report(f"📊 http 模式：{args.url}，{args.readers} 讀 / {args.writers} 寫，{args.seconds:.0f} 秒",
+           args.seconds, reads, writes, errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="歷史紀錄讀取 vs. 口試資料寫入的資料庫併發基準測試")
+    sub = parser.add_subparsers(dest="mode", required=True)
+
+    db_parser = sub.add_parser("db", help="在暫存 SQLite 上直接呼叫 endpoint 函式")
+    db_parser.add_argument("--extra-logs", type=int, default=20000, help="預先寫入的歷史紀錄筆數")
+    db_parser.add_argument("--writers", type=int, default=8, help="寫入執行緒數")
+
+    http_parser = sub.add_parser("http", help="對執行中的後端送出 HTTP 請求")
+    http_parser.add_argument("--url", default="http://127.0.0.1:8088", help="後端網址")
+    http_parser.add_argument("--student-ids", default="M11402165", help="以逗號分隔、資料庫中存在的學號")
+    http_parser.add_argument("--writers", type=int, default=4, help="寫入執行緒數")
+
+    for p in (db_parser, http_parser):
+        p.add_argument("--seconds", type=float, default=10, help="持續時間 (秒)")
+        p.add_argument("--readers", type=int, default=16, help="讀取執行緒數")
+
+    args = parser.parse_args()
+    if args.mode == "db":
+        bench_db(args)
+    else:
+        bench_http(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
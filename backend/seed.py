@@ -1,8 +1,13 @@
 import csv
+import hashlib
+import io
 import os
+from sqlalchemy import insert, select, update
 from sqlalchemy.orm import Session
 import models
-from database import SessionLocal, engine
+from database import SessionLocal, engine, advisory_lock
+from services.roster_index import invalidate_roster_index
+from services.location_index import invalidate_location_index
 
 # BASE_DIR 現在是 backend/
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -14,69 +19,145 @@ DATA_DIR = os.path.join(PROJECT_ROOT, "data")
 PROFESSORS_CSV = os.path.join(DATA_DIR, "professors.csv")
 STUDENTS_CSV = os.path.join(DATA_DIR, "students.csv")
 # ✨ 新增地點資料的 CSV 路徑
-LOCATIONS_CSV = os.path.join(DATA_DIR, "locations.csv") 
+LOCATIONS_CSV = os.path.join(DATA_DIR, "locations.csv")
 
-def run_seed():
+# 預設只新增資料庫中沒有的列 (與過去行為相同)；設為 true 時，CSV 內容有變的既有列也會一併更新
+SEED_UPDATE_EXISTING = os.getenv("SEED_UPDATE_EXISTING", "false").lower() == "true"
+
+
+def read_csv_rows(content: bytes):
+    # 使用 utf-8-sig 可以過濾掉 Excel 存檔時可能產生的隱藏 BOM 字元
+    return list(csv.DictReader(io.StringIO(content.decode("utf-8-sig"))))
+
+
+# 資料表名稱 -> (Model, 預設 CSV 路徑, 顯示名稱)，順序即匯入順序 (必須先建教授，學生才能綁定指導教授)
+SEED_TABLES = {
+    "professors": (models.Professor, PROFESSORS_CSV, "教授資料"),
+    "students": (models.Student, STUDENTS_CSV, "學生資料"),
+    "locations": (models.DefenseLocation, LOCATIONS_CSV, "地點資料"),
+}
+
+
+def blank_foreign_keys_to_null(model, row: dict) -> dict:
+    """外鍵欄位留白代表沒有對應資料 (例如尚未指定指導教授)，存成 NULL；PostgreSQL 會拒絕指向空字串的外鍵"""
+    for col in model.__table__.columns:
+        if col.foreign_keys and col.nullable and col.name in row and not (row[col.name] or "").strip():
+            row[col.name] = None
+    return row
+
+
+def existing_rows(db: Session, model, keys=None) -> dict:
+    """一次查出既有資料 (主鍵 -> 欄位)，取代逐列 filter_by().first()；keys 為 None 時查整張表"""
+    table = model.__table__
+    pk = table.primary_key.columns.values()[0]
+    stmt = select(table)
+    if keys is not None:
+        stmt = stmt.where(pk.in_(list(keys)))
+    return {r[pk.name]: r for r in db.execute(stmt).mappings()}
+
+
+def upsert_rows(db: Session, model, rows: dict, existing: dict, update_existing: bool):
+    """
+    rows 為 主鍵 -> CSV 列；新列整批 INSERT，update_existing 時內容有變動的既有列整批 UPDATE。
+    只執行不提交，回傳 (新增筆數, 更新筆數)。
+    """
+    new_rows = [row for key, row in rows.items() if key not in existing]
+    changed_rows = []
+    if update_existing:
+        for key, row in rows.items():
+            current = existing.get(key)
+            if current is not None and any((current[col] or "") != (value or "") for col, value in row.items()):
+                changed_rows.append(row)
+
+    if new_rows:
+        db.execute(insert(model.__table__), new_rows)
+    if changed_rows:
+        # 以主鍵比對的 ORM 批次更新 (executemany)
+        db.execute(update(model), changed_rows)
+    return len(new_rows), len(changed_rows)
+
+
+def seed_table(db: Session, model, csv_path: str, label: str, update_existing: bool = SEED_UPDATE_EXISTING) -> bool:
+    """
+    以批次方式把一份 CSV 同步進資料表，回傳資料表是否有異動。
+    CSV 內容雜湊與上次匯入相同就直接略過；否則一次查出既有資料，再交給 upsert_rows 整批寫入。
+    """
+    table = model.__table__
+    filename = os.path.basename(csv_path)
+    if not os.path.exists(csv_path):
+        print(f"⚠️ 找不到{label}：{csv_path}")
+        return False
+
+    with open(csv_path, "rb") as f:
+        content = f.read()
+    digest = hashlib.sha256(content).hexdigest()
+    state = db.get(models.SeedState, table.name)
+    if state is not None and state.content_sha256 == digest:
+        print(f"⏭️ {label} ({filename}) 內容未變更，略過")
+        return False
+
+    pk = table.primary_key.columns.values()[0]
+    rows = {}
+    for row in read_csv_rows(content):
+        # 同一份 CSV 裡重複的主鍵以第一筆為準
+        rows.setdefault(row[pk.name], blank_foreign_keys_to_null(model, row))
+
+    inserted, updated = upsert_rows(db, model, rows, existing_rows(db, model), update_existing)
+
+    if state is None:
+        state = models.SeedState(table_name=table.name)
+        db.add(state)
+    state.content_sha256 = digest
+    state.row_count = len(rows)
+    db.commit()
+    print(f"✅ {label} ({filename}) 同步完成！新增 {inserted} 筆，更新 {updated} 筆")
+    return bool(inserted or updated)
+
+
+def run_seed(raise_errors: bool = False):
+    """
+    raise_errors=False (預設、同步啟動) 時匯入失敗只記錄並繼續提供服務，與過去行為相同；
+    延後啟動的背景暖身傳 True，讓 readiness 記錄失敗原因並維持 503
+    """
+    # 多台後端同時啟動時依序播種，後到的只會看到雜湊相同而略過
+    with advisory_lock("seed"):
+        _run_seed(raise_errors)
+
+
+def _run_seed(raise_errors: bool = False):
     db = SessionLocal()
     try:
         print("🔍 啟動資料庫初始化程序...")
-        
+
+        # 批次 INSERT/UPDATE 不經過 Session 的 flush 事件，索引要自行通知失效
         # ==========================================
         # 1. 匯入教授資料 (順序很重要！必須先建教授，學生才能綁定指導教授)
         # ==========================================
-        if os.path.exists(PROFESSORS_CSV):
-            # 使用 utf-8-sig 可以過濾掉 Excel 存檔時可能產生的隱藏 BOM 字元
-            with open(PROFESSORS_CSV, "r", encoding="utf-8-sig") as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    # 檢查這名教授是否已經在資料庫裡了 (冪等性)
-                    exists = db.query(models.Professor).filter_by(professor_id=row["professor_id"]).first()
-                    if not exists:
-                        db.add(models.Professor(**row))
-            db.commit()
-            print("✅ 教授資料 (professors.csv) 同步完成！")
-        else:
-            print(f"⚠️ 找不到教授名單：{PROFESSORS_CSV}")
+        if seed_table(db, models.Professor, PROFESSORS_CSV, "教授資料"):
+            invalidate_roster_index()
 
         # ==========================================
         # 2. 匯入學生資料
         # ==========================================
-        if os.path.exists(STUDENTS_CSV):
-            with open(STUDENTS_CSV, "r", encoding="utf-8-sig") as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    # 檢查這名學生是否已經在資料庫裡了 (冪等性)
-                    exists = db.query(models.Student).filter_by(student_id=row["student_id"]).first()
-                    if not exists:
-                        db.add(models.Student(**row))
-            db.commit()
-            print("✅ 學生資料 (students.csv) 同步完成！")
-        else:
-            print(f"⚠️ 找不到學生名單：{STUDENTS_CSV}")
+        seed_table(db, models.Student, STUDENTS_CSV, "學生資料")
 
         # ==========================================
         # ✨ 3. 匯入地點資料
         # ==========================================
-        if os.path.exists(LOCATIONS_CSV):
-            with open(LOCATIONS_CSV, "r", encoding="utf-8-sig") as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    # 檢查該地點是否已經在資料庫裡了 (冪等性)
-                    exists = db.query(models.DefenseLocation).filter_by(location_id=row["location_id"]).first()
-                    if not exists:
-                        db.add(models.DefenseLocation(**row))
-            db.commit()
-            print("✅ 地點資料 (locations.csv) 同步完成！")
-        else:
-            print(f"⚠️ 找不到地點資料：{LOCATIONS_CSV}")
+        if seed_table(db, models.DefenseLocation, LOCATIONS_CSV, "地點資料"):
+            invalidate_location_index()
 
     except Exception as e:
         print(f"❌ CSV 資料匯入失敗，請檢查格式：{e}")
         db.rollback()
+        if raise_errors:
+            raise
     finally:
         db.close()
 
 # 單獨測試用
 if __name__ == "__main__":
+    from migrate import run_migrations
     models.Base.metadata.create_all(bind=engine)
-    run_seed()
\ No newline at end of file
+    run_migrations()
+    run_seed()
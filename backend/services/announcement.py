@@ -0,0 +1,237 @@
+import json
+import os
+import re
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from sqlalchemy.orm import Session, joinedload
+
+import models
+import schemas
+from services.generator import generate_ppt, ppt_filename, download_cache, DOWNLOADS_DIR
+
+# ==========================================
+# 口試佈告資料組裝 (submit_and_generate 與批次生成共用)
+# ==========================================
+
+# 批次生成時同時渲染的檔案數 (已啟動渲染行程池時，實際平行度也受行程數限制)
+BATCH_RENDER_WORKERS = int(os.getenv("BATCH_RENDER_WORKERS", str(os.cpu_count() or 2)))
+
+_COMMITTEE_SPLIT_RE = re.compile(r'[，、,]+')
+_WEEKDAYS = ["一", "二", "三", "四", "五", "六", "日"]
+# 存檔的日期/時間是顯示用字串 (民國115年6月20日(星期六)、9:00)，排序前先解析成數字
+_ROC_DATE_RE = re.compile(r'民國\s*(\d+)\s*年\s*(\d+)\s*月\s*(\d+)\s*日')
+_TIME_RE = re.compile(r'(\d{1,2})\s*[:：]\s*(\d{2})')
+
+
+def format_defense_date(defense_date: str) -> str:
+    """西元 YYYY-MM-DD 轉民國年格式；無法解析時原樣保留"""
+    try:
+        dt = datetime.strptime(defense_date, "%Y-%m-%d")
+    except ValueError:
+        return defense_date
+    roc_year = dt.year - 1911
+    return f"民國{roc_year}年{dt.month}月{dt.day}日(星期{_WEEKDAYS[dt.weekday()]})"
+
+
+def order_committee(student, final_committee_str: str):
+    """切分委員名單，並強制確保指導教授排在最末位"""
+    raw_committee = _COMMITTEE_SPLIT_RE.split(final_committee_str)
+    final_committee_list = [m.strip() for m in raw_committee if m.strip()]
+
+    # 最終防線：無論 LLM 傳入的順序為何，強制確保指導教授排在委員名單最末位
+    if student.advisor:
+        advisor_full_submit = f"{student.advisor.professor_name} {student.advisor.professor_title} ({student.advisor.department_name})"
+        # 尋找名單中是否有包含指導教授姓名的項目（容錯：格式可能略有不同）
+        advisor_idx = next(
+            (i for i, m in enumerate(final_committee_list)
+             if student.advisor.professor_name in m),
+            None
+        )
+        if advisor_idx is not None:
+            # 已存在：移到最後
+            final_committee_list.append(final_committee_list.pop(advisor_idx))
+        else:
+            # 不存在：補入最後（以資料庫標準格式）
+            final_committee_list.append(advisor_full_submit)
+
+    return final_committee_list
+
+
+def build_defense_log(student, item, formatted_date: str, committee_list):
+    return models.DefenseLog(
+        student_id=student.student_id,
+        defense_date_text=formatted_date,
+        defense_time_text=item.defense_time,
+        location_full_text=item.final_location,
+        committee_json=json.dumps(committee_list, ensure_ascii=False)
+    )
+
+
+def build_ppt_data(student, item, formatted_date: str, committee_list) -> schemas.FullPPTData:
+    advisor_full = f"{student.advisor.professor_name} {student.advisor.professor_title} {student.advisor.department_name}" if student.advisor else ""
+    return schemas.FullPPTData(
+        student_id=student.student_id,
+        student_name=student.student_name,
+        thesis_title_zh=student.thesis_title_zh,
+        thesis_title_en=student.thesis_title_en,
+        advisor_full_text=advisor_full,
+        defense_date_text=formatted_date,
+        defense_time_text=item.defense_time,
+        location_full_text=item.final_location,
+        committee_members=committee_list
+    )
+
+
+def build_ppt_data_from_log(log) -> schemas.FullPPTData:
+    """以已存檔的 DefenseLog 重組 PPT 資料 (合併簡報用)"""
+    student = log.student
+    advisor_full = f"{student.advisor.professor_name} {student.advisor.professor_title} {student.advisor.department_name}" if student.advisor else ""
+    return schemas.FullPPTData(
+        student_id=student.student_id,
+        student_name=student.student_name,
+        thesis_title_zh=student.thesis_title_zh,
+        thesis_title_en=student.thesis_title_en,
+        advisor_full_text=advisor_full,
+        defense_date_text=log.defense_date_text,
+        defense_time_text=log.defense_time_text,
+        location_full_text=log.location_full_text,
+        committee_members=json.loads(log.committee_json)
+    )
+
+
+def schedule_sort_key(log):
+    """
+    依實際口試日期與時間排序；直接比較字串會把「14:00」排在「9:00」前、「10月」排在「6月」前。
+    無法解析的日期/時間排在可解析者之後，再依原字串與學號排序，順序仍然固定。
+    """
+    date_match = _ROC_DATE_RE.search(log.defense_date_text or "")
+    time_match = _TIME_RE.search(log.defense_time_text or "")
+    date_key = (0, tuple(int(n) for n in date_match.groups())) if date_match else (1, ())
+    time_key = (0, tuple(int(n) for n in time_match.groups())) if time_match else (1, ())
+    return date_key, log.defense_date_text or "", time_key, log.defense_time_text or "", log.student_id
+
+
+def session_logs(db: Session, defense_date: str = None, location: str = None):
+    """
+    某一場次 (日期及/或地點) 的口試紀錄，同一位學生只取最新一筆，依口試時間排序。
+    defense_date 為西元 YYYY-MM-DD，比對時轉成與存檔相同的民國年格式。
+    """
+    query = db.query(models.DefenseLog).options(
+        joinedload(models.DefenseLog.student).joinedload(models.Student.advisor)
+    )
+    if defense_date:
+        query = query.filter(models.DefenseLog.defense_date_text == format_defense_date(defense_date))
+    if location:
+        query = query.filter(models.DefenseLog.location_full_text == location)
+
+    latest = {}
+    for log in query.order_by(models.DefenseLog.log_id).all():
+        if log.student is not None:
+            latest[log.student_id] = log
+    return sorted(latest.values(), key=schedule_sort_key)
+
+
+# ==========================================
+# 批次生成：整個口試週的佈告一次處理
+# ==========================================
+def generate_batch(db: Session, items, workers: int = None, pinned: list = None):
+    """
+    items 為 submit_and_generate 格式的請求清單 (需有 student_id / defense_date / defense_time /
+    final_location / final_committee_str 屬性)。
+    學生一次查詢、DefenseLog 一次交易寫入、PPT 平行渲染，最後一次寫回下載路徑。
+    回傳 manifest，每筆結果與輸入順序一一對應。
+    pinned 為 list 時，產出的檔案在回傳後仍保持 pin (路徑加入 pinned)，磁碟快取不會在打包前淘汰它們；
+    呼叫端用完要 download_cache.unpin(*pinned)。
+    """
+    student_ids = {item.student_id for item in items}
+    students = {
+        s.student_id: s
+        for s in db.query(models.Student)
+        .options(joinedload(models.Student.advisor))
+        .filter(models.Student.student_id.in_(student_ids))
+        .all()
+    } if student_ids else {}
+
+    results = []
+    pending = []  # (results 索引, DefenseLog, FullPPTData)
+    for index, item in enumerate(items):
+        student = students.get(item.student_id)
+        if not student:
+            results.append({"index": index, "student_id": item.student_id, "status": "error", "message": "查無此學生資料"})
+            continue
+        formatted_date = format_defense_date(item.defense_date)
+        committee_list = order_committee(student, item.final_committee_str)
+        log = build_defense_log(student, item, formatted_date, committee_list)
+        results.append({"index": index, "student_id": student.student_id, "status": "pending"})
+        pending.append((index, log, build_ppt_data(student, item, formatted_date, committee_list)))
+
+    if pending:
+        db.add_all([log for _, log, _ in pending])
+        db.commit()
+
+    # 提交後 ORM 物件的屬性已過期，讀取會經由 Session 重新查詢，而 Session 不能跨執行緒共用；
+    # 因此在目前執行緒先取出 log_id，渲染執行緒只拿到純值 (log_id, FullPPTData)
+    logs_by_index = {index: log for index, log, _ in pending}
+    jobs = [(index, log.log_id, full_data) for index, log, full_data in pending]
+    if pinned is not None:
+        # 先 pin 再渲染：後面的檔案加入時，前面已完成的檔案不會因超出磁碟預算而被刪除
+        paths = [os.path.join(DOWNLOADS_DIR, ppt_filename(full_data.student_id, log_id)) for _, log_id, full_data in jobs]
+        download_cache.pin(*paths)
+        pinned.extend(paths)
+
+    def render(job):
+        index, log_id, full_data = job
+        try:
+            return index, log_id, generate_ppt(full_data, log_id), None
+        except Exception as e:
+            print(f"❌ 批次生成 PPT 失敗 ({full_data.student_id})：{e}")
+            return index, log_id, None, str(e)
+
+    # generate_ppt 不碰資料庫；已啟動行程池時每個執行緒只是在等待工作行程
+    workers = max(1, workers or BATCH_RENDER_WORKERS)
+    with ThreadPoolExecutor(max_workers=min(workers, len(jobs) or 1)) as executor:
+        rendered = list(executor.map(render, jobs))
+
+    for index, log_id, filename, error in rendered:
+        entry = results[index]
+        entry["log_id"] = log_id
+        if error:
+            entry.update(status="error", message=f"PPT 生成失敗：{error}")
+            continue
+        download_url = f"/api/v1/downloads/{filename}"
+        logs_by_index[index].generated_file_url = download_url
+        logs_by_index[index].generated_filename = filename
+        entry.update(status="success", filename=filename, download_url=download_url)
+
+    if rendered:
+        db.commit()
+
+    succeeded = sum(1 for r in results if r["status"] == "success")
+    return {
+        "status": "success" if succeeded == len(results) else ("partial" if succeeded else "error"),
+        "total": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "items": results,
+    }
+
+
+def write_batch_zip(db: Session, manifest, fileobj):
+    """
+    把批次產出的 PPTX 與 manifest.json 打包成單一 zip (PPTX 本身已壓縮，直接儲存不再壓縮)。
+    檔案若已不在下載目錄 (例如被共用目錄的其他行程淘汰)，依 DefenseLog 重新渲染後再打包。
+    """
+    with zipfile.ZipFile(fileobj, "w", zipfile.ZIP_STORED) as zf:
+        zf.writestr("manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2))
+        for entry in manifest["items"]:
+            if entry["status"] != "success":
+                continue
+            file_path = os.path.join(DOWNLOADS_DIR, entry["filename"])
+            with download_cache.pinned(file_path):
+                try:
+                    zf.write(file_path, entry["filename"])
+                except FileNotFoundError:
+                    log = db.get(models.DefenseLog, entry["log_id"])
+                    generate_ppt(build_ppt_data_from_log(log), log.log_id)
+                    zf.write(file_path, entry["filename"])
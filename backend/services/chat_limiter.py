@@ -0,0 +1,164 @@
+import asyncio
+import os
+import time
+from collections import defaultdict, deque
+
+# ==========================================
+# 對話代理的併發限制與背壓
+# 同時轉送給 Dify 的對話數有上限，超過的請求在有上限的佇列中等待；
+# 佇列滿或等太久就立即回 503，單一學生同時進行的對話過多則回 429，並附上 Retry-After
+# ==========================================
+
+CHAT_MAX_CONCURRENT = int(os.getenv("CHAT_MAX_CONCURRENT", "20"))
+CHAT_MAX_WAITING = int(os.getenv("CHAT_MAX_WAITING", "50"))
+CHAT_MAX_WAIT_SECONDS = float(os.getenv("CHAT_MAX_WAIT_SECONDS", "15"))
+# 每位學生同時進行中的對話數 (含排隊中)
+CHAT_PER_STUDENT_LIMIT = int(os.getenv("CHAT_PER_STUDENT_LIMIT", "2"))
+CHAT_RETRY_AFTER = int(os.getenv("CHAT_RETRY_AFTER", "5"))
+
+
+class ChatLimitError(Exception):
+    """超過併發限制；status_code 為 429 (單一學生過多) 或 503 (整體忙碌)"""
+
+    def __init__(self, status_code: int, message: str, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.retry_after = retry_after
+
+
+class ChatSlot:
+    """
+    取得的對話名額；release 可重複呼叫，只有第一次生效。
+    和 ChatLimiter 一樣只能在事件迴圈上使用：release 是 coroutine，不可丟進執行緒池執行。
+    """
+
+    def __init__(self, limiter, student_id: str):
+        self._limiter = limiter
+        self.student_id = student_id
+        self._released = False
+        self._response = None
+
+    def attach(self, response):
+        """登記這個名額對應的上游串流回應，歸還名額時一併關閉"""
+        self._response = response
+
+    async def release(self):
+        if self._released:
+            return
+        self._released = True
+        # 先同步歸還名額，之後關閉上游連線時即使被取消也不會漏還
+        self._limiter._release(self.student_id)
+        if self._response is not None:
+            await self._response.aclose()
+
+
+class ChatLimiter:
+    """
+    只在事件迴圈執行緒中使用，因此不需要鎖。
+    等待者各自持有一個 future，釋放名額時直接交給最早排隊的人 (FIFO)。
+    """
+
+    def __init__(self, max_concurrent: int, max_waiting: int, max_wait_seconds: float,
+                 per_student_limit: int, retry_after: int):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_waiting = max_waiting
+        self.max_wait_seconds = max_wait_seconds
+        self.per_student_limit = per_student_limit
+        self.retry_after = retry_after
+        self._active = 0
+        self._waiters = deque()
+        self._per_student = defaultdict(int)
+        self.admitted = 0
+        self.rejected_student = 0
+        self.rejected_busy = 0
+        self.timeouts = 0
+        self._waited = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    async def acquire(self, student_id: str) -> ChatSlot:
+        if self.per_student_limit > 0 and self._per_student.get(student_id, 0) >= self.per_student_limit:
+            self.rejected_student += 1
+            raise ChatLimitError(429, "您已有對話正在處理中，請等待回覆後再送出。", self.retry_after)
+
+        if self._active < self.max_concurrent and not self._waiters:
+            self._active += 1
+        else:
+            if len(self._waiters) >= self.max_waiting:
+                self.rejected_busy += 1
+                raise ChatLimitError(503, "目前使用人數眾多，請稍後再試。", self.retry_after)
+            await self._wait(student_id)
+
+        self._per_student[student_id] += 1
+        self.admitted += 1
+        return ChatSlot(self, student_id)
+
+    async def _wait(self, student_id: str):
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        # 排隊中也算在該學生的進行中對話內，避免同一人灌爆佇列
+        self._per_student[student_id] += 1
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(future, self.max_wait_seconds)
+        except asyncio.TimeoutError:
+            # 逾時與名額交接發生在同一輪事件迴圈時，future 已拿到名額：直接放行，否則名額會永遠沒人歸還
+            if future.done() and not future.cancelled():
+                return
+            self.timeouts += 1
+            self.rejected_busy += 1
+            raise ChatLimitError(503, "目前使用人數眾多，請稍後再試。", self.retry_after)
+        except asyncio.CancelledError:
+            # 已被分配名額卻在交接瞬間被取消 (例如前端斷線)，要把名額還回去
+            if future.done() and not future.cancelled():
+                self._hand_off()
+            raise
+        finally:
+            self._decrement(student_id)
+            if not future.done() or future.cancelled():
+                try:
+                    self._waiters.remove(future)
+                except ValueError:
+                    pass
+            waited = time.monotonic() - started
+            self._waited += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+
+    def _hand_off(self):
+        # 名額直接交給下一位仍在等待的人，_active 不變；沒人等待時才真正釋放
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self._active -= 1
+
+    def _decrement(self, student_id: str):
+        self._per_student[student_id] -= 1
+        if self._per_student[student_id] <= 0:
+            del self._per_student[student_id]
+
+    def _release(self, student_id: str):
+        self._decrement(student_id)
+        self._hand_off()
+
+    def stats(self):
+        return {
+            "max_concurrent": self.max_concurrent,
+            "in_flight": self._active,
+            "waiting": len(self._waiters),
+            "max_waiting": self.max_waiting,
+            "admitted": self.admitted,
+            "rejected_per_student": self.rejected_student,
+            "rejected_busy": self.rejected_busy,
+            "wait_timeouts": self.timeouts,
+            "avg_wait_ms": round(self._wait_total / self._waited * 1000, 1) if self._waited else 0.0,
+            "max_wait_ms": round(self._wait_max * 1000, 1),
+        }
+
+
+chat_limiter = ChatLimiter(
+    CHAT_MAX_CONCURRENT, CHAT_MAX_WAITING, CHAT_MAX_WAIT_SECONDS, CHAT_PER_STUDENT_LIMIT, CHAT_RETRY_AFTER
+)
@@ -0,0 +1,147 @@
+import os
+import re
+from functools import lru_cache
+
+# ==========================================
+# 委員名單解析 (split_members / parse_member)
+# Agent 在 ReAct 迴圈中常重送同一段委員文字，解析結果以 LRU 快取重複利用
+# ==========================================
+
+MEMBER_PARSE_CACHE_SIZE = int(os.getenv("MEMBER_PARSE_CACHE_SIZE", "1024"))
+
+TITLE_KEYWORDS = ["講座教授", "特聘教授", "助理教授", "副教授", "教授", "博士"]
+ORG_KEYWORDS = ["系", "所", "公司", "院", "中心", "處", "局", "部", "大學", "學院", "研究室", "實驗室", "科大"]
+TITLE_OR_ORG_HINTS = TITLE_KEYWORDS + ORG_KEYWORDS
+
+_SEPARATOR_RE = re.compile(r"[，、,;；/｜|\n\t]+")
+_LATIN_RE = re.compile(r"[A-Za-z]")
+_BRACKET_RE = re.compile(r"[()（）\[\]{}【】]")
+_WHITESPACE_RE = re.compile(r"\s+")
+_CJK_NAME_RE = re.compile(r"[\u4e00-\u9fff]{2,4}")
+_NON_NAME_CHAR_RE = re.compile(r"[^\u4e00-\u9fffA-Za-z]")
+_ORG_EDGE_RE = re.compile(r"^[\s:：,，、\-—]+|[\s:：,，、\-—]+$")
+_WRAPPED_RE = re.compile(r"^[\(\[（【].*[\)\]）】]$")
+_OPEN_BRACKET_RE = re.compile(r"^[\(\[（【]\s*")
+_CLOSE_BRACKET_RE = re.compile(r"\s*[\)\]）】]$")
+# 「姓名 + 職稱」模式，每個職稱各預先編譯一次
+_NAME_WITH_TITLE_RE = {title: re.compile(rf"([\u4e00-\u9fff]{{2,4}})\s*{title}") for title in TITLE_KEYWORDS}
+
+
+@lru_cache(maxsize=MEMBER_PARSE_CACHE_SIZE)
+def _split_members(raw_members_text: str):
+    text = (raw_members_text or "").strip()
+    if not text:
+        return ()
+
+    # 先統一常見分隔符
+    text = _SEPARATOR_RE.sub(",", text)
+    chunks = [chunk.strip() for chunk in text.split(",") if chunk.strip()]
+
+    members = []
+    for chunk in chunks:
+        # 僅在「看起來是多個純中文姓名」時，才用空白再切一次
+        if (
+            " " in chunk
+            and not _LATIN_RE.search(chunk)
+            and not _BRACKET_RE.search(chunk)
+            and not any(hint in chunk for hint in TITLE_OR_ORG_HINTS)
+        ):
+            spaced_parts = [part.strip() for part in _WHITESPACE_RE.split(chunk) if part.strip()]
+            if spaced_parts and all(_CJK_NAME_RE.fullmatch(p) for p in spaced_parts):
+                members.extend(spaced_parts)
+                continue
+
+        members.append(chunk)
+
+    return tuple(members)
+
+
+def split_members(raw_members_text: str):
+    """將使用者輸入的委員文字切成個別成員 (回傳新的 list，可自由修改)"""
+    return list(_split_members(raw_members_text or ""))
+
+
+def normalize_org_text(s: str) -> str:
+    org = (s or "").strip()
+    org = _ORG_EDGE_RE.sub("", org)
+
+    # 去除最外層括號，避免輸出時組成 ((單位))
+    while org and _WRAPPED_RE.match(org):
+        stripped = _OPEN_BRACKET_RE.sub("", org)
+        stripped = _CLOSE_BRACKET_RE.sub("", stripped)
+        stripped = stripped.strip()
+        if stripped == org:
+            break
+        org = stripped
+
+    return org
+
+
+@lru_cache(maxsize=MEMBER_PARSE_CACHE_SIZE)
+def _parse_member(raw_text: str):
+    text = raw_text.strip()
+    detected_title = ""
+    for title in TITLE_KEYWORDS:
+        if title in text:
+            detected_title = title
+            break
+
+    has_org_hint = any(k in text for k in ORG_KEYWORDS)
+
+    name_candidate = text
+    org_candidate = text
+
+    # 先嘗試「姓名 + 職稱」模式，避免把姓名與單位黏在一起
+    if detected_title:
+        m = _NAME_WITH_TITLE_RE[detected_title].search(text)
+        if m:
+            name_candidate = m.group(1)
+            org_candidate = text.replace(m.group(0), "", 1)
+
+    if name_candidate == text:
+        for title in TITLE_KEYWORDS:
+            name_candidate = name_candidate.replace(title, "")
+        name_candidate = _BRACKET_RE.sub("", name_candidate)
+        name_candidate = _WHITESPACE_RE.sub("", name_candidate)
+        name_candidate = _NON_NAME_CHAR_RE.sub("", name_candidate)
+
+        org_candidate = text
+        if name_candidate:
+            org_candidate = org_candidate.replace(name_candidate, "")
+        if detected_title:
+            org_candidate = org_candidate.replace(detected_title, "")
+
+    org_candidate = normalize_org_text(org_candidate)
+
+    return {
+        "raw": text,
+        "clean_name": name_candidate,
+        "detected_title": detected_title,
+        "has_org_hint": has_org_hint,
+        "org_candidate": org_candidate
+    }
+
+
+def parse_member(raw_text: str):
+    """解析單一成員字串的姓名/職稱/單位線索 (回傳新的 dict，可自由修改)"""
+    return dict(_parse_member(raw_text))
+
+
+def is_likely_person_name(name: str) -> bool:
+    return _CJK_NAME_RE.fullmatch(name or "") is not None
+
+
+def parser_cache_stats():
+    """回傳兩個解析快取的命中統計，用來觀察真實對話中的重複率"""
+    stats = {}
+    for key, func in (("split_members", _split_members), ("parse_member", _parse_member)):
+        info = func.cache_info()
+        total = info.hits + info.misses
+        stats[key] = {
+            "hits": info.hits,
+            "misses": info.misses,
+            "hit_rate": round(info.hits / total, 4) if total else 0.0,
+            "size": info.currsize,
+            "max_size": info.maxsize,
+        }
+    return stats
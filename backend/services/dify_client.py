@@ -0,0 +1,52 @@
+import os
+import httpx
+
+# ==========================================
+# Dify API 共用連線池 (非同步)
+# 每輪對話不再重新建立 TCP + TLS 連線，等待 LLM 回覆時也不佔用執行緒
+# ==========================================
+
+DIFY_MAX_CONNECTIONS = int(os.getenv("DIFY_MAX_CONNECTIONS", "100"))
+DIFY_MAX_KEEPALIVE = int(os.getenv("DIFY_MAX_KEEPALIVE", "20"))
+DIFY_KEEPALIVE_EXPIRY = float(os.getenv("DIFY_KEEPALIVE_EXPIRY", "30"))
+DIFY_CONNECT_TIMEOUT = float(os.getenv("DIFY_CONNECT_TIMEOUT", "10"))
+# Agent 在 ReAct 迴圈中可能數十秒才送出下一段，讀取逾時要放寬
+DIFY_READ_TIMEOUT = float(os.getenv("DIFY_READ_TIMEOUT", "300"))
+
+_client = None
+
+
+def start_dify_client():
+    """在 lifespan 啟動時建立共用的 AsyncClient"""
+    global _client
+    if _client is not None:
+        return _client
+    _client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=DIFY_MAX_CONNECTIONS,
+            max_keepalive_connections=DIFY_MAX_KEEPALIVE,
+            keepalive_expiry=DIFY_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            connect=DIFY_CONNECT_TIMEOUT,
+            read=DIFY_READ_TIMEOUT,
+            write=DIFY_CONNECT_TIMEOUT,
+            pool=DIFY_CONNECT_TIMEOUT,
+        ),
+    )
+    print(f"🔗 Dify 連線池已建立：最多 {DIFY_MAX_CONNECTIONS} 條連線，保留 {DIFY_MAX_KEEPALIVE} 條 keep-alive")
+    return _client
+
+
+async def close_dify_client():
+    global _client
+    if _client is None:
+        return
+    await _client.aclose()
+    _client = None
+    print("🔗 Dify 連線池已關閉")
+
+
+def get_dify_client() -> httpx.AsyncClient:
+    # 未經 lifespan 啟動 (例如單獨匯入 app 測試) 時自動建立
+    return _client or start_dify_client()
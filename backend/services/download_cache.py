@@ -0,0 +1,162 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# ==========================================
+# 下載目錄的磁碟用量控管 (LRU 淘汰)
+# 被淘汰的 PPT 仍保留 DefenseLog，下次下載時會依紀錄重新生成
+# 正在生成、下載或打包中的檔案以 pin 標記，淘汰時略過，用完 unpin 後才會被淘汰
+# ==========================================
+
+
+class DownloadCache:
+    """
+    以檔名記錄最近使用順序；容量以實體檔 (inode) 計算，hard link 到同一份內容的檔名不重複計算。
+    不以修改時間標記使用紀錄，因為下載的 ETag 取自 mtime，改動會讓瀏覽器快取失效。
+    """
+
+    def __init__(self, directory: str, store_dir: str, max_bytes: int):
+        self.directory = directory
+        self.store_dir = store_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._lru = OrderedDict()      # 檔名 -> inode
+        self._inode_size = {}          # inode -> 位元組數
+        self._inode_names = {}         # inode -> 指向它的檔名數
+        self._total = 0
+        self._pins = {}                # 完整路徑 -> pin 次數
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def load(self):
+        """開機時掃描既有檔案，依修改時間由舊到新排入，超過預算就先淘汰"""
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(".pptx"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.name, stat))
+        entries.sort()
+        with self._lock:
+            for _, name, stat in entries:
+                self._track(name, stat)
+            self._evict()
+        print(f"🗂️ 下載目錄：{len(self._lru)} 個檔案，{self._total / 1048576:.1f} MB"
+              + (f" (上限 {self.max_bytes / 1048576:.0f} MB)" if self.max_bytes > 0 else ""))
+
+    def touch(self, filename: str):
+        """下載命中既有檔案時呼叫，更新使用順序"""
+        with self._lock:
+            self.hits += 1
+            if filename in self._lru:
+                self._lru.move_to_end(filename)
+                return
+        self.add(filename, count=False)
+
+    def add(self, filename: str, count: bool = True):
+        """新生成 (或重新生成) 檔案後呼叫，必要時淘汰最久未使用的檔案"""
+        try:
+            stat = os.stat(os.path.join(self.directory, filename))
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if count:
+                self.misses += 1
+            self._untrack(filename)
+            self._track(filename, stat)
+            self._evict()
+
+    def pin(self, *paths: str):
+        """標記使用中的檔案 (下載目錄或去重存放區的完整路徑)；檔案尚不存在也可以先 pin"""
+        with self._lock:
+            for path in paths:
+                key = os.path.abspath(path)
+                self._pins[key] = self._pins.get(key, 0) + 1
+
+    def unpin(self, *paths: str):
+        """解除 pin；期間因 pin 而超出的容量在這裡補做淘汰"""
+        with self._lock:
+            for path in paths:
+                key = os.path.abspath(path)
+                count = self._pins.get(key, 0) - 1
+                if count > 0:
+                    self._pins[key] = count
+                else:
+                    self._pins.pop(key, None)
+            self._evict()
+
+    @contextmanager
+    def pinned(self, *paths: str):
+        self.pin(*paths)
+        try:
+            yield
+        finally:
+            self.unpin(*paths)
+
+    def _is_pinned(self, path: str) -> bool:
+        return os.path.abspath(path) in self._pins
+
+    def _track(self, filename: str, stat):
+        inode = stat.st_ino
+        self._lru[filename] = inode
+        if self._inode_names.get(inode, 0) == 0:
+            self._inode_size[inode] = stat.st_size
+            self._total += stat.st_size
+        self._inode_names[inode] = self._inode_names.get(inode, 0) + 1
+
+    def _untrack(self, filename: str):
+        inode = self._lru.pop(filename, None)
+        if inode is None:
+            return
+        self._inode_names[inode] -= 1
+        if self._inode_names[inode] == 0:
+            del self._inode_names[inode]
+            self._total -= self._inode_size.pop(inode)
+
+    def _evict(self):
+        if self.max_bytes <= 0:
+            return
+        evicted = False
+        newest = next(reversed(self._lru), None)
+        for filename in list(self._lru):
+            if self._total <= self.max_bytes:
+                break
+            # 最新加入的檔案 (正要被下載) 與使用中的檔案一定保留
+            if filename == newest or self._is_pinned(os.path.join(self.directory, filename)):
+                continue
+            self._untrack(filename)
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except FileNotFoundError:
+                pass
+            self.evictions += 1
+            evicted = True
+        if evicted:
+            self._sweep_store()
+
+    def _sweep_store(self):
+        # 去重存放區中已沒有任何檔名指向的實體檔 (link 數只剩 1) 一併刪除，才真正釋放空間
+        if not os.path.isdir(self.store_dir):
+            return
+        with os.scandir(self.store_dir) as it:
+            for entry in it:
+                if (entry.is_file() and entry.name.endswith(".pptx") and entry.stat().st_nlink <= 1
+                        and not self._is_pinned(entry.path)):
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "files": len(self._lru),
+                "bytes": self._total,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "pinned": len(self._pins),
+            }
@@ -0,0 +1,100 @@
+import os
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+# ==========================================
+# SQLite FTS5 (trigram) 子字串搜尋 (選用)
+# 全校地點名冊很大時，以 trigram 索引取代逐筆掃描，避免查詢延遲隨資料量線性成長
+# 教授比對是模糊計分而非子字串搜尋，已由記憶體中的名冊索引以字元倒排剪枝，不另建 FTS
+# ==========================================
+
+FTS_ENABLED = os.getenv("ENABLE_FTS_SEARCH", "false").lower() in ("1", "true", "yes")
+
+# trigram 至少要 3 個字元才能走索引，更短的關鍵字交回記憶體比對
+FTS_MIN_KEYWORD_LENGTH = 3
+
+# (FTS 虛擬表, 來源資料表, 主鍵, 可搜尋欄位)
+FTS_TABLES = [
+    ("defense_locations_fts", "defense_locations", "location_id", ["room_number", "full_location_name", "building_name"]),
+]
+
+# 舊版曾建立、已不再使用的 FTS 虛擬表；連同 trigger 一起移除，教授資料寫入時不必再維護索引
+OBSOLETE_FTS_TABLES = ["professors_fts"]
+
+_fts_ready = False
+
+
+def _fts_ddl(fts_table: str, source_table: str, columns):
+    col_list = ", ".join(columns)
+    new_values = ", ".join(f"new.{c}" for c in columns)
+    old_values = ", ".join(f"old.{c}" for c in columns)
+    return [
+        # external content 表：內容仍存在原資料表，FTS 只存索引
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5("
+        f"{col_list}, content='{source_table}', content_rowid='rowid', tokenize='trigram')",
+        # 以 trigger 與原資料表同步，任何寫入路徑 (seed、API) 都不必另外處理
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_ai AFTER INSERT ON {source_table} BEGIN "
+        f"INSERT INTO {fts_table}(rowid, {col_list}) VALUES (new.rowid, {new_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_ad AFTER DELETE ON {source_table} BEGIN "
+        f"INSERT INTO {fts_table}({fts_table}, rowid, {col_list}) VALUES ('delete', old.rowid, {old_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_au AFTER UPDATE ON {source_table} BEGIN "
+        f"INSERT INTO {fts_table}({fts_table}, rowid, {col_list}) VALUES ('delete', old.rowid, {old_values}); "
+        f"INSERT INTO {fts_table}(rowid, {col_list}) VALUES (new.rowid, {new_values}); END",
+    ]
+
+
+def setup_fts(engine) -> bool:
+    """建立 FTS5 虛擬表與同步 trigger，並重建索引；未啟用或環境不支援時回傳 False"""
+    global _fts_ready
+    if not FTS_ENABLED:
+        return False
+    if engine.dialect.name != "sqlite":
+        print(f"⚠️ FTS5 僅支援 SQLite，目前資料庫為 {engine.dialect.name}，改用記憶體比對")
+        return False
+
+    try:
+        with engine.begin() as conn:
+            for fts_table in OBSOLETE_FTS_TABLES:
+                for suffix in ("ai", "ad", "au"):
+                    conn.execute(text(f"DROP TRIGGER IF EXISTS {fts_table}_{suffix}"))
+                conn.execute(text(f"DROP TABLE IF EXISTS {fts_table}"))
+            for fts_table, source_table, _, columns in FTS_TABLES:
+                for stmt in _fts_ddl(fts_table, source_table, columns):
+                    conn.execute(text(stmt))
+                # 重建一次，涵蓋啟用 FTS 之前就已存在的資料
+                conn.execute(text(f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')"))
+    except OperationalError as e:
+        # trigram tokenizer 需要 SQLite 3.34 以上
+        print(f"⚠️ SQLite 不支援 FTS5 trigram，改用記憶體比對：{e}")
+        return False
+
+    _fts_ready = True
+    print("🔎 FTS5 trigram 索引已就緒")
+    return True
+
+
+def _quote_phrase(keyword: str) -> str:
+    return '"' + keyword.replace('"', '""') + '"'
+
+
+def _search_ids(db: Session, fts_table: str, source_table: str, key_column: str, keyword: str):
+    if not _fts_ready or len(keyword or "") < FTS_MIN_KEYWORD_LENGTH:
+        return None
+    rows = db.execute(
+        text(
+            f"SELECT s.{key_column} FROM {fts_table} f JOIN {source_table} s ON s.rowid = f.rowid "
+            f"WHERE {fts_table} MATCH :q"
+        ),
+        {"q": _quote_phrase(keyword)}
+    ).all()
+    return [row[0] for row in rows]
+
+
+def search_location_ids(db: Session, keyword: str):
+    """
+    房號/全名/館舍名稱包含關鍵字 (不分大小寫) 的地點 ID。
+    FTS 未啟用或關鍵字太短時回傳 None，呼叫端應改用記憶體比對。
+    """
+    fts_table, source_table, key_column, _ = FTS_TABLES[0]
+    return _search_ids(db, fts_table, source_table, key_column, keyword)
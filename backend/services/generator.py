@@ -1,5 +1,19 @@
+import hashlib
+import io
+import json
+import multiprocessing
 import os
+import posixpath
+import re
+import shutil
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from xml.sax.saxutils import escape as xml_escape
+from lxml import etree
 from pptx import Presentation
+from services.download_cache import DownloadCache
 
 # 1. BASE_DIR 依然是你的後端目錄 (backend/)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -15,56 +29,373 @@ os.makedirs(DOWNLOADS_DIR, exist_ok=True)
 TEMPLATES_DIR = os.path.join(PROJECT_ROOT, "templates")
 TEMPLATE_FILE = os.path.join(TEMPLATES_DIR, "defense_template.pptx")
 
-def replace_text_in_slide(slide, replacements):
-    """
-    遍歷投影片中的所有形狀，尋找並替換文字。
-    解決 PPT 底層會把同一個單字切碎 (Runs) 導致無法匹配的問題。
-    """
-    for shape in slide.shapes:
+# 模板中所有的佔位符
+PLACEHOLDERS = [
+    "{{student_name}}",
+    "{{student_id}}",
+    "{{thesis_title_zh}}",
+    "{{thesis_title_en}}",
+    "{{advisor_full_text}}",
+    "{{defense_date_text}}",
+    "{{defense_time_text}}",
+    "{{location_full_text}}",
+    "{{committee_members_list}}",
+]
+
+# 是否啟用直接替換 XML 的快速路徑 (關閉時一律走 python-pptx)
+PPT_FAST_PATH = os.getenv("PPT_FAST_PATH", "true").lower() in ("1", "true", "yes")
+
+# 內容定址去重：相同資料 + 相同模板的 PPT 只渲染一次，之後以 hard link 重複利用
+PPT_DEDUP = os.getenv("PPT_DEDUP", "true").lower() in ("1", "true", "yes")
+# 去重用的實體檔存放處 (放在 downloads 底下才能 hard link；下載 API 不接受含 / 的檔名，外部無法直接存取)
+CONTENT_STORE_DIR = os.path.join(DOWNLOADS_DIR, ".store")
+
+# 下載目錄的磁碟用量上限 (MB，0 = 不限制)；超過時淘汰最久未下載的檔案，之後下載會再重新生成
+DOWNLOAD_DISK_BUDGET_MB = float(os.getenv("DOWNLOAD_DISK_BUDGET_MB", "0"))
+download_cache = DownloadCache(DOWNLOADS_DIR, CONTENT_STORE_DIR, int(DOWNLOAD_DISK_BUDGET_MB * 1048576))
+
+# 多行程渲染的工作行程數 (0 = 不啟用，在呼叫端的執行緒內直接渲染)
+RENDER_PROCESSES = int(os.getenv("RENDER_PROCESSES", "0"))
+# 工作行程的啟動方式：uvicorn 行程裡已有執行緒池、生成佇列等多條執行緒，直接 fork 可能複製到被鎖住的鎖而卡死，
+# 因此預設用 forkserver (由單執行緒的 server 行程 fork 出工作行程)，不支援的平台改用 spawn
+RENDER_START_METHOD = os.getenv("RENDER_START_METHOD", "forkserver")
+# 行程池崩潰 (例如工作行程被 OOM killer 砍掉) 時最多重建幾次，超過就停用行程池、改在目前行程渲染
+RENDER_POOL_MAX_RESTARTS = int(os.getenv("RENDER_POOL_MAX_RESTARTS", "3"))
+
+# 5. 模板快取：位元組只從磁碟讀一次 (mtime 改變才重讀)，每次生成從記憶體開啟
+_template_lock = threading.Lock()
+_template_cache = None  # (mtime, 模板位元組, 含佔位符的 (shape 索引, 段落索引) 清單, CompiledTemplate, 模板雜湊)
+
+# 與 python-pptx 相同：除了 Tab 與換行以外的控制字元改寫成 _xHHHH_
+_CTRL_CHAR_RE = re.compile(r"([\x00-\x08\x0B-\x1F])")
+# XML 不允許的字元，lxml 遇到時會拋錯，快速路徑也比照辦理
+_INVALID_XML_RE = re.compile(r"[\ud800-\udfff\ufffe\uffff]")
+
+
+_NS = {
+    "p": "http://schemas.openxmlformats.org/presentationml/2006/main",
+    "r": "http://schemas.openxmlformats.org/officeDocument/2006/relationships",
+    "ct": "http://schemas.openxmlformats.org/package/2006/content-types",
+}
+
+
+def _qn(tag: str) -> str:
+    prefix, local = tag.split(":")
+    return "{%s}%s" % (_NS[prefix], local)
+
+
+def _prefix_of(element, namespace: str) -> str:
+    for prefix, uri in element.nsmap.items():
+        if uri == namespace and prefix:
+            return prefix
+    raise ValueError(f"找不到命名空間前綴：{namespace}")
+
+
+def _serialize(element) -> bytes:
+    return etree.tostring(element, xml_declaration=True, encoding="UTF-8", standalone=True)
+
+
+def _split_once(data: bytes, marker: str):
+    marker = marker.encode("utf-8")
+    if data.count(marker) != 1:
+        raise ValueError("合併簡報的插入標記不唯一")
+    return data.split(marker)
+
+
+def _find_placeholder_targets(slide):
+    """找出含有佔位符的 (shape 索引, 段落索引)，讓替換時只需走訪這些段落"""
+    targets = []
+    for shape_idx, shape in enumerate(slide.shapes):
         if not shape.has_text_frame:
             continue
-            
-        for paragraph in shape.text_frame.paragraphs:
-            # 1. 把整個段落所有切碎的片段，先無縫接軌拼成一句完整的話
+        for para_idx, paragraph in enumerate(shape.text_frame.paragraphs):
             full_text = "".join([run.text for run in paragraph.runs])
-            
-            # 2. 檢查這整句話裡有沒有需要替換的變數
-            needs_replace = False
-            for placeholder in replacements.keys():
-                if placeholder in full_text:
-                    needs_replace = True
-                    break
-            
-            # 3. 如果有找到變數，就整段進行替換
-            if needs_replace:
-                for placeholder, value in replacements.items():
-                    full_text = full_text.replace(placeholder, str(value or ""))
-                    
-                # 4. 為了保留你的字體排版格式，我們把替換完的完整句子塞回第一個片段，並把多餘的片段清空
-                if len(paragraph.runs) > 0:
-                    paragraph.runs[0].text = full_text
-                    for i in range(1, len(paragraph.runs)):
-                        paragraph.runs[i].text = ""
+            if any(placeholder in full_text for placeholder in PLACEHOLDERS):
+                targets.append((shape_idx, para_idx))
+    return targets
 
-def generate_ppt(payload, log_id: int) -> str:
+
+class CompiledTemplate:
     """
-    讀取模板 PPTX，替換其中的佔位符資料，並產出新檔案。
+    快速路徑用的預編譯模板。
+    投影片 XML 被切成「固定字串片段」與「佔位符槽位」交錯的清單；
+    佔位符被切碎在多個 <a:r> 的問題在編譯時就處理掉 (與 replace_text_in_slide 相同：整段併入第一個 run)。
+    其他未變動的 zip 成員預先打包好，生成時只需附加替換後的投影片 XML。
     """
-    # 1. 檢查模板檔案是否存在
-    if not os.path.exists(TEMPLATE_FILE):
+
+    _MARKER = "DEFENSEBOTSLOT{:04d}END"
+
+    def __init__(self, template_bytes: bytes, targets):
+        prs = Presentation(io.BytesIO(template_bytes))
+        slide = prs.slides[0]
+        self.slide_member = slide.part.partname.lstrip("/")
+
+        # 每個槽位記住該段落原本的完整文字 (含佔位符)，生成時再做替換
+        shapes = list(slide.shapes)
+        self.slots = []
+        markers = []
+        for slot_idx, (shape_idx, para_idx) in enumerate(targets):
+            paragraph = shapes[shape_idx].text_frame.paragraphs[para_idx]
+            self.slots.append("".join([run.text for run in paragraph.runs]))
+            marker = self._MARKER.format(slot_idx)
+            markers.append(marker.encode("utf-8"))
+            paragraph.runs[0].text = marker
+            for i in range(1, len(paragraph.runs)):
+                paragraph.runs[i].text = ""
+
+        # 以 python-pptx 存檔時相同的序列化方式取得投影片 XML，再依標記切開
+        blob = slide.part.blob
+        self.chunks = []
+        for marker in markers:
+            if blob.count(marker) != 1:
+                raise ValueError("模板投影片中的佔位符標記不唯一，無法預編譯")
+            head, blob = blob.split(marker)
+            self.chunks.append(head)
+        self.chunks.append(blob)
+
+        # 除了投影片以外的成員原封不動，預先壓縮成一份 zip 前綴
+        prefix = io.BytesIO()
+        with zipfile.ZipFile(io.BytesIO(template_bytes)) as zin, zipfile.ZipFile(prefix, "w") as zout:
+            for info in zin.infolist():
+                if info.filename == self.slide_member:
+                    self.slide_info = info
+                    continue
+                zout.writestr(info, zin.read(info.filename))
+        self.prefix_bytes = prefix.getvalue()
+
+        # 合併簡報 (一位學生一張投影片) 用的套件片段；模板不只一張投影片時不支援
+        self.deck_error = None
+        try:
+            self._compile_deck(prs, slide, template_bytes)
+        except ValueError as e:
+            self.deck_error = str(e)
+
+    def _compile_deck(self, prs, slide, template_bytes: bytes):
+        """
+        合併簡報需要改寫的只有投影片清單相關的四個成員：
+        presentation.xml (sldIdLst)、presentation.xml.rels、[Content_Types].xml 與 docProps/app.xml。
+        這裡先把它們切成「前段 + 插入點 + 後段」，生成時只需串接字串，不必重新解析模板。
+        """
+        if len(prs.slides) != 1:
+            raise ValueError("模板必須只有一張投影片才能生成合併簡報")
+
+        pres_part = prs.part
+        self.pres_member = pres_part.partname.lstrip("/")
+        self.pres_rels_member = pres_part.partname.baseURI.lstrip("/") + "/_rels/" + pres_part.partname.filename + ".rels"
+        slide_rels_member = slide.part.partname.baseURI.lstrip("/") + "/_rels/" + slide.part.partname.filename + ".rels"
+        slide_rel_id = next(rId for rId, rel in pres_part.rels.items() if rel.target_part is slide.part)
+        slide_dir = slide.part.partname.baseURI.lstrip("/")
+        self.slide_path_fmt = slide_dir + "/slide{}.xml"
+        self.slide_rels_path_fmt = slide_dir + "/_rels/slide{}.xml.rels"
+        self.slide_rel_target_fmt = posixpath.relpath(self.slide_path_fmt, pres_part.partname.baseURI.lstrip("/"))
+
+        marker = self._MARKER.format(9999)
+        with zipfile.ZipFile(io.BytesIO(template_bytes)) as zin:
+            members = {info.filename: info for info in zin.infolist()}
+
+            # presentation.xml：清空 sldIdLst，換成標記後切開
+            pres_xml = etree.fromstring(zin.read(self.pres_member))
+            sld_id_lst = pres_xml.find(_qn("p:sldIdLst"))
+            first_id = int(sld_id_lst[0].get("id"))
+            for child in list(sld_id_lst):
+                sld_id_lst.remove(child)
+            sld_id_lst.text = marker
+            self.sld_id_fmt = '<{}:sldId id="{{}}" {}:id="{{}}"/>'.format(
+                _prefix_of(pres_xml, _NS["p"]), _prefix_of(pres_xml, _NS["r"])
+            )
+            self.sld_id_base = first_id
+            self.pres_parts = _split_once(_serialize(pres_xml), marker)
+
+            # presentation.xml.rels：拿掉原本那張投影片的關聯，其餘保留
+            rels_xml = etree.fromstring(zin.read(self.pres_rels_member))
+            existing_ids = set()
+            for rel in list(rels_xml):
+                if rel.get("Id") == slide_rel_id:
+                    self.slide_rel_type = rel.get("Type")
+                    rels_xml.remove(rel)
+                else:
+                    existing_ids.add(rel.get("Id"))
+            rels_xml.append(etree.Comment(marker))
+            self.rel_id_fmt = "rIdDeck{}"
+            if any(rel_id.startswith("rIdDeck") for rel_id in existing_ids):
+                raise ValueError("presentation.xml.rels 已有 rIdDeck 開頭的關聯 ID")
+            self.pres_rels_parts = _split_once(_serialize(rels_xml), "<!--" + marker + "-->")
+
+            # 投影片本身的關聯 (版面配置、圖片) 每張複本共用；備忘稿不能共用，直接拿掉
+            slide_rels_xml = etree.fromstring(zin.read(slide_rels_member))
+            for rel in list(slide_rels_xml):
+                if rel.get("Type", "").endswith("/notesSlide"):
+                    slide_rels_xml.remove(rel)
+            self.slide_rels_bytes = _serialize(slide_rels_xml)
+
+            # [Content_Types].xml：把原本那張投影片的 Override 換成 N 張
+            ct_xml = etree.fromstring(zin.read("[Content_Types].xml"))
+            slide_override = None
+            for override in ct_xml.findall("{%s}Override" % _NS["ct"]):
+                if override.get("PartName") == "/" + self.slide_member:
+                    slide_override = override
+            if slide_override is None:
+                raise ValueError("[Content_Types].xml 找不到投影片的 Override")
+            self.slide_content_type = slide_override.get("ContentType")
+            ct_xml.remove(slide_override)
+            ct_xml.append(etree.Comment(marker))
+            self.ct_parts = _split_once(_serialize(ct_xml), "<!--" + marker + "-->")
+
+            # docProps/app.xml 的投影片張數 (僅供顯示，找不到就不改)
+            self.app_parts = None
+            app_bytes = zin.read("docProps/app.xml") if "docProps/app.xml" in members else b""
+            if app_bytes.count(b"<Slides>1</Slides>") == 1:
+                self.app_parts = app_bytes.split(b"<Slides>1</Slides>")
+
+            rewritten = {self.slide_member, slide_rels_member, self.pres_member, self.pres_rels_member, "[Content_Types].xml"}
+            if self.app_parts is not None:
+                rewritten.add("docProps/app.xml")
+            deck_prefix = io.BytesIO()
+            with zipfile.ZipFile(deck_prefix, "w") as zout:
+                for name, info in members.items():
+                    if name not in rewritten:
+                        zout.writestr(info, zin.read(name))
+        self.deck_prefix_bytes = deck_prefix.getvalue()
+
+    @staticmethod
+    def _encode_text(text: str) -> bytes:
+        if _INVALID_XML_RE.search(text):
+            raise ValueError("All strings must be XML compatible")
+        text = _CTRL_CHAR_RE.sub(lambda m: "_x%04X_" % ord(m.group(1)), text)
+        return xml_escape(text).replace("\r", "&#13;").encode("utf-8")
+
+    def render_slide_xml(self, replacements) -> bytes:
+        parts = [self.chunks[0]]
+        for slot_text, chunk in zip(self.slots, self.chunks[1:]):
+            full_text = slot_text
+            for placeholder, value in replacements.items():
+                full_text = full_text.replace(placeholder, str(value or ""))
+            parts.append(self._encode_text(full_text))
+            parts.append(chunk)
+        return b"".join(parts)
+
+    def render(self, replacements) -> bytes:
+        slide_xml = self.render_slide_xml(replacements)
+
+        # 複製預先打包好的前綴，再以附加模式寫入替換後的投影片
+        buffer = io.BytesIO(self.prefix_bytes)
+        buffer.seek(0, io.SEEK_END)
+        with zipfile.ZipFile(buffer, "a") as zout:
+            zout.writestr(self.slide_info, slide_xml)
+        return buffer.getvalue()
+
+    def render_deck(self, replacements_list) -> bytes:
+        """每組 replacements 產生一張投影片，全部放進同一份簡報"""
+        if self.deck_error:
+            raise ValueError(self.deck_error)
+        if not replacements_list:
+            raise ValueError("合併簡報至少需要一張投影片")
+
+        numbers = range(1, len(replacements_list) + 1)
+        sld_ids = "".join(self.sld_id_fmt.format(self.sld_id_base + i - 1, self.rel_id_fmt.format(i)) for i in numbers)
+        rels = "".join(
+            f'<Relationship Id="{self.rel_id_fmt.format(i)}" Type="{self.slide_rel_type}" '
+            f'Target="{self.slide_rel_target_fmt.format(i)}"/>'
+            for i in numbers
+        )
+        overrides = "".join(
+            f'<Override PartName="/{self.slide_path_fmt.format(i)}" ContentType="{self.slide_content_type}"/>'
+            for i in numbers
+        )
+
+        buffer = io.BytesIO(self.deck_prefix_bytes)
+        buffer.seek(0, io.SEEK_END)
+        with zipfile.ZipFile(buffer, "a", zipfile.ZIP_DEFLATED) as zout:
+            zout.writestr("[Content_Types].xml", self.ct_parts[0] + overrides.encode("utf-8") + self.ct_parts[1])
+            zout.writestr(self.pres_member, self.pres_parts[0] + sld_ids.encode("utf-8") + self.pres_parts[1])
+            zout.writestr(self.pres_rels_member, self.pres_rels_parts[0] + rels.encode("utf-8") + self.pres_rels_parts[1])
+            if self.app_parts is not None:
+                count = f"<Slides>{len(replacements_list)}</Slides>".encode("utf-8")
+                zout.writestr("docProps/app.xml", self.app_parts[0] + count + self.app_parts[1])
+            for i, replacements in zip(numbers, replacements_list):
+                zout.writestr(self.slide_path_fmt.format(i), self.render_slide_xml(replacements))
+                zout.writestr(self.slide_rels_path_fmt.format(i), self.slide_rels_bytes)
+        return buffer.getvalue()
+
+
+def load_template():
+    """
+    回傳 (模板位元組, 佔位符位置, 預編譯模板)。
+    以 mtime 判斷模板是否被更新，更新後自動重新載入並重新編譯。
+    預編譯失敗時第三個值為 None，生成時會退回 python-pptx。
+    """
+    global _template_cache
+    try:
+        mtime = os.stat(TEMPLATE_FILE).st_mtime_ns
+    except FileNotFoundError:
         raise FileNotFoundError(f"找不到模板檔案，請確認路徑：{TEMPLATE_FILE}")
 
-    # 2. 載入模板簡報
-    prs = Presentation(TEMPLATE_FILE)
-    
-    # 3. 取得第一張投影片 (通常模板只有一張)
-    slide = prs.slides[0]
-    
-    # 4. 準備要替換的資料對照表 (佔位符 -> 真實資料)
+    cache = _template_cache
+    if cache is not None and cache[0] == mtime:
+        return cache[1], cache[2], cache[3]
+
+    with _template_lock:
+        cache = _template_cache
+        if cache is not None and cache[0] == mtime:
+            return cache[1], cache[2], cache[3]
+
+        with open(TEMPLATE_FILE, "rb") as f:
+            data = f.read()
+        targets = _find_placeholder_targets(Presentation(io.BytesIO(data)).slides[0])
+        try:
+            compiled = CompiledTemplate(data, targets)
+        except Exception as e:
+            print(f"⚠️ PPT 模板預編譯失敗，改用 python-pptx 生成：{e}")
+            compiled = None
+        _template_cache = (mtime, data, targets, compiled, hashlib.sha256(data).hexdigest())
+        print(f"📄 PPT 模板已載入記憶體：{len(data)} bytes，{len(targets)} 個佔位符段落")
+        return data, targets, compiled
+
+
+def replace_text_in_slide(slide, replacements, targets=None):
+    """
+    遍歷投影片中的所有形狀，尋找並替換文字。
+    解決 PPT 底層會把同一個單字切碎 (Runs) 導致無法匹配的問題。
+    若有傳入 targets (預先算好的佔位符位置)，則只走訪這些段落。
+    """
+    if targets is not None:
+        shapes = list(slide.shapes)
+        paragraphs = [shapes[s].text_frame.paragraphs[p] for s, p in targets]
+    else:
+        paragraphs = [
+            paragraph
+            for shape in slide.shapes if shape.has_text_frame
+            for paragraph in shape.text_frame.paragraphs
+        ]
+
+    for paragraph in paragraphs:
+        # 1. 把整個段落所有切碎的片段，先無縫接軌拼成一句完整的話
+        full_text = "".join([run.text for run in paragraph.runs])
+
+        # 2. 檢查這整句話裡有沒有需要替換的變數
+        needs_replace = False
+        for placeholder in replacements.keys():
+            if placeholder in full_text:
+                needs_replace = True
+                break
+
+        # 3. 如果有找到變數，就整段進行替換
+        if needs_replace:
+            for placeholder, value in replacements.items():
+                full_text = full_text.replace(placeholder, str(value or ""))
+
+            # 4. 為了保留你的字體排版格式，我們把替換完的完整句子塞回第一個片段，並把多餘的片段清空
+            if len(paragraph.runs) > 0:
+                paragraph.runs[0].text = full_text
+                for i in range(1, len(paragraph.runs)):
+                    paragraph.runs[i].text = ""
+
+def build_replacements(payload):
+    """準備要替換的資料對照表 (佔位符 -> 真實資料)"""
     # 先處理口試委員清單，加上縮排符號
     committee_text = "\n".join([f"    {c}" for c in payload.committee_members])
-    
-    replacements = {
+
+    return {
         "{{student_name}}": payload.student_name,
         "{{student_id}}": payload.student_id,
         "{{thesis_title_zh}}": payload.thesis_title_zh,
@@ -75,15 +406,232 @@ def generate_ppt(payload, log_id: int) -> str:
         "{{location_full_text}}": payload.location_full_text,
         "{{committee_members_list}}": committee_text
     }
-    
-    # 5. 執行替換邏輯
-    replace_text_in_slide(slide, replacements)
-    
-    # 6. 存檔
-    filename = f"defense_{payload.student_id}_{log_id}.pptx"
+
+def render_ppt(payload, fast_path: bool = None) -> bytes:
+    """
+    依 payload 生成 PPTX 並回傳檔案內容。
+    預設走預編譯的 XML 快速路徑，模板無法預編譯或 fast_path=False 時改用 python-pptx。
+    """
+    if fast_path is None:
+        fast_path = PPT_FAST_PATH
+
+    # 1. 取得記憶體中的模板 (找不到模板時會拋出 FileNotFoundError)
+    template_bytes, targets, compiled = load_template()
+    replacements = build_replacements(payload)
+
+    if fast_path and compiled is not None:
+        return compiled.render(replacements)
+
+    # 2. 從記憶體中的位元組開啟模板簡報，不再每次讀檔
+    prs = Presentation(io.BytesIO(template_bytes))
+
+    # 3. 取得第一張投影片 (通常模板只有一張)，執行替換邏輯
+    replace_text_in_slide(prs.slides[0], replacements, targets)
+
+    output = io.BytesIO()
+    prs.save(output)
+    return output.getvalue()
+
+# ==========================================
+# 多行程渲染：lxml/zip 屬於 CPU 密集工作，交給獨立行程才能吃滿多核心、不與事件迴圈搶 GIL
+# ==========================================
+_process_pool = None
+_process_pool_lock = threading.Lock()
+_process_pool_workers = 0
+_process_pool_restarts = 0
+
+
+def _init_render_worker():
+    # 每個工作行程啟動時先載入並預編譯模板，第一筆工作就不必等待
+    load_template()
+
+
+def _mp_context():
+    method = RENDER_START_METHOD if RENDER_START_METHOD in multiprocessing.get_all_start_methods() else "spawn"
+    ctx = multiprocessing.get_context(method)
+    if method == "forkserver":
+        # server 行程先匯入渲染模組 (lxml、python-pptx)，之後 fork 出的工作行程不必再各自匯入
+        ctx.set_forkserver_preload(["services.generator"])
+    return ctx
+
+
+def _new_process_pool(workers: int):
+    return ProcessPoolExecutor(max_workers=workers, mp_context=_mp_context(), initializer=_init_render_worker)
+
+
+def start_process_pool(workers: int = None):
+    """建立渲染行程池；workers <= 0 時不建立，generate_ppt 會在目前執行緒渲染"""
+    global _process_pool, _process_pool_workers, _process_pool_restarts
+    workers = RENDER_PROCESSES if workers is None else workers
+    with _process_pool_lock:
+        if workers <= 0 or _process_pool is not None:
+            return
+        _process_pool = _new_process_pool(workers)
+        _process_pool_workers = workers
+        _process_pool_restarts = 0
+    print(f"🏭 PPT 渲染行程池已啟動：{workers} 個工作行程")
+
+
+def shutdown_process_pool(wait: bool = True):
+    global _process_pool
+    with _process_pool_lock:
+        pool, _process_pool = _process_pool, None
+    if pool is None:
+        return
+    pool.shutdown(wait=wait, cancel_futures=not wait)
+    print("🏭 PPT 渲染行程池已關閉")
+
+
+def _replace_broken_pool(broken):
+    """行程池崩潰後就無法再使用：重建一個新的，重建次數用完則停用行程池"""
+    global _process_pool, _process_pool_restarts
+    with _process_pool_lock:
+        # 其他執行緒可能已經處理過同一個崩潰的行程池
+        if _process_pool is not broken:
+            return
+        if _process_pool_restarts < RENDER_POOL_MAX_RESTARTS:
+            _process_pool_restarts += 1
+            _process_pool = _new_process_pool(_process_pool_workers)
+            print(f"⚠️ PPT 渲染行程池異常，已重建 (第 {_process_pool_restarts} 次)")
+        else:
+            _process_pool = None
+            print("⚠️ PPT 渲染行程池反覆異常，停用行程池，之後改在目前行程渲染")
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def process_pool_stats():
+    with _process_pool_lock:
+        return {
+            "configured": RENDER_PROCESSES,
+            "active": _process_pool is not None,
+            "workers": _process_pool_workers if _process_pool is not None else 0,
+            "restarts": _process_pool_restarts,
+        }
+
+
+def _render_to_file(payload, file_path: str):
+    # 在工作行程內直接寫檔，避免把整份 PPTX 位元組傳回主行程
+    content = render_ppt(payload)
+    # 先寫暫存檔再換名，其他請求不會讀到寫到一半的檔案
+    tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, file_path)
+
+
+def _run_rendering(func, *args):
+    """已啟動行程池時交給工作行程執行，呼叫端執行緒只等待結果"""
+    pool = _process_pool
+    if pool is not None:
+        try:
+            return pool.submit(func, *args).result()
+        except BrokenProcessPool:
+            # 這一筆改在目前行程渲染，之後的工作交給重建的行程池
+            _replace_broken_pool(pool)
+    return func(*args)
+
+
+_dedup_lock = threading.Lock()
+_dedup_counts = {"hits": 0, "misses": 0}
+
+
+def template_version() -> str:
+    """目前模板內容的 SHA-256，模板檔更新後會跟著改變"""
+    load_template()
+    return _template_cache[4]
+
+
+def payload_digest(payload) -> str:
+    """PPT 資料 + 模板版本的內容雜湊，相同雜湊代表產出的檔案內容必然相同"""
+    data = json.dumps(payload.model_dump(), ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(f"{template_version()}\n{data}".encode("utf-8")).hexdigest()
+
+
+def _link_or_copy(source: str, target: str):
+    # 先建立暫存名稱再換名，同一檔案被同時生成時也不會互相踩到
+    tmp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.link(source, tmp_path)
+    except FileNotFoundError:
+        # 來源不存在要讓呼叫端知道 (可能剛被淘汰)，不可退回複製
+        raise
+    except OSError:
+        # 檔案系統不支援 hard link 時退回複製
+        shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, target)
+
+
+def dedup_stats():
+    with _dedup_lock:
+        total = _dedup_counts["hits"] + _dedup_counts["misses"]
+        return {
+            "enabled": PPT_DEDUP,
+            **_dedup_counts,
+            "hit_rate": round(_dedup_counts["hits"] / total, 4) if total else 0.0,
+        }
+
+
+def ppt_filename(student_id: str, log_id: int) -> str:
+    return f"defense_{student_id}_{log_id}.pptx"
+
+
+def generate_ppt(payload, log_id: int) -> str:
+    """
+    讀取模板 PPTX，替換其中的佔位符資料，並產出新檔案。
+    已啟動行程池時交給工作行程渲染，呼叫端執行緒只等待結果。
+    啟用去重時，同樣內容只渲染一次，其餘紀錄的檔案都 hard link 到同一份實體檔。
+    """
+    filename = ppt_filename(payload.student_id, log_id)
     file_path = os.path.join(DOWNLOADS_DIR, filename)
-    prs.save(file_path)
-    
-    print(f"✅ PPT 生成成功：{file_path}")
+
+    if PPT_DEDUP:
+        stored_path = os.path.join(CONTENT_STORE_DIR, f"{payload_digest(payload)}.pptx")
+        # 渲染到 link 之間存放區的實體檔只有一個連結，pin 住才不會被其他請求觸發的清除刪掉
+        with download_cache.pinned(stored_path, file_path):
+            reused = os.path.isfile(stored_path)
+            if reused:
+                try:
+                    _link_or_copy(stored_path, file_path)
+                except FileNotFoundError:
+                    # 實體檔剛好被磁碟快取淘汰，改為重新渲染
+                    reused = False
+            if not reused:
+                os.makedirs(CONTENT_STORE_DIR, exist_ok=True)
+                _run_rendering(_render_to_file, payload, stored_path)
+                try:
+                    _link_or_copy(stored_path, file_path)
+                except FileNotFoundError:
+                    # 共用下載目錄的其他行程 (各有自己的磁碟快取) 剛好清掉了實體檔，直接渲染到下載路徑
+                    _run_rendering(_render_to_file, payload, file_path)
+            download_cache.add(filename)
+        with _dedup_lock:
+            _dedup_counts["hits" if reused else "misses"] += 1
+        print(f"✅ PPT 生成成功{' (重複利用既有檔案)' if reused else ''}：{file_path}")
+    else:
+        with download_cache.pinned(file_path):
+            _run_rendering(_render_to_file, payload, file_path)
+            download_cache.add(filename)
+        print(f"✅ PPT 生成成功：{file_path}")
+
     # 回傳生成的檔案名稱
-    return filename
\ No newline at end of file
+    return filename
+
+
+# ==========================================
+# 合併簡報：同一場次 (日期/地點) 每位學生一張投影片，一次組成單一 PPTX
+# ==========================================
+def _render_deck(payloads) -> bytes:
+    _, _, compiled = load_template()
+    if compiled is None:
+        raise ValueError("模板無法預編譯，無法生成合併簡報")
+    return compiled.render_deck([build_replacements(payload) for payload in payloads])
+
+
+def generate_deck(payloads) -> bytes:
+    """
+    依 payloads 順序產生多張投影片的簡報並回傳檔案內容。
+    投影片直接由預編譯模板複製，成本隨張數線性成長，不會重新解析模板。
+    """
+    content = _run_rendering(_render_deck, list(payloads))
+    print(f"✅ 合併簡報生成成功：{len(payloads)} 張投影片")
+    return content
@@ -0,0 +1,135 @@
+import re
+import threading
+from collections import namedtuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import models
+from database import SessionLocal
+from services.fts_search import search_location_ids
+
+# ==========================================
+# 口試地點索引 (Location Index)
+# 開機時建立一次，query_location 的熱路徑完全在記憶體內完成，不再查 SQLite
+# ==========================================
+
+# room_norm / name_norm：預先正規化的房號與全名
+# search_fields：預先轉小寫的房號、全名、館舍名稱，取代 SQL 的 ilike('%keyword%')
+LocationRecord = namedtuple(
+    "LocationRecord",
+    ["location_id", "building_name", "room_number", "full_location_name", "room_norm", "name_norm", "name_lower", "search_fields"]
+)
+
+# 移除連字號/全形連字號/空白，讓「IB101」能精確比對到資料庫中的「IB-101」
+_LOCATION_SEP_RE = re.compile(r'[\s\-\u2010-\u2015\u2212\uFF0D]+')
+
+
+def normalize_location_text(s: str) -> str:
+    return _LOCATION_SEP_RE.sub('', s or '').lower()
+
+
+class LocationIndex:
+    """某一版本地點名冊的唯讀快照，可安全地跨執行緒共用"""
+
+    def __init__(self, locations, version: int = 0):
+        self.version = version
+        self.records = []
+        for loc in locations:
+            fields = [loc.room_number, loc.full_location_name, loc.building_name]
+            self.records.append(LocationRecord(
+                loc.location_id,
+                loc.building_name,
+                loc.room_number,
+                loc.full_location_name,
+                normalize_location_text(loc.room_number),
+                normalize_location_text(loc.full_location_name),
+                (loc.full_location_name or "").lower(),
+                tuple(f.lower() for f in fields if f)
+            ))
+        self.names = [r.full_location_name for r in self.records]
+        self.lower_by_name = {r.full_location_name: r.name_lower for r in self.records}
+        self.position_by_id = {r.location_id: pos for pos, r in enumerate(self.records)}
+
+        # 正規化房號 -> 地點 (同房號可能有多筆，保留名冊順序)
+        self.by_room_norm = {}
+        for record in self.records:
+            self.by_room_norm.setdefault(record.room_norm, []).append(record)
+
+    def find_room(self, keyword_norm: str):
+        return self.by_room_norm.get(keyword_norm, [])
+
+    def search(self, keyword: str, db: Session = None):
+        """
+        房號/全名/館舍名稱任一欄位包含關鍵字 (不分大小寫)，等同原本的三欄 ilike 查詢。
+        有傳入 db 且已啟用 FTS5 時改走 trigram 索引，結果仍依名冊順序排列。
+        """
+        if db is not None:
+            ids = search_location_ids(db, keyword)
+            if ids is not None:
+                positions = sorted(self.position_by_id[i] for i in ids if i in self.position_by_id)
+                return [self.records[pos] for pos in positions]
+
+        kw = (keyword or "").lower()
+        return [r for r in self.records if any(kw in field for field in r.search_fields)]
+
+
+# ==========================================
+# 全域索引與失效機制 (與 roster_index 相同：交易提交後才遞增版本)
+# ==========================================
+_lock = threading.Lock()
+_index = None
+_version = 0
+
+
+def invalidate_location_index():
+    global _version
+    with _lock:
+        _version += 1
+
+
+def get_location_index(db: Session = None) -> LocationIndex:
+    """取得目前的地點索引，若尚未建立或已失效則重建"""
+    index = _index
+    if index is not None and index.version == _version:
+        return index
+
+    with _lock:
+        if _index is not None and _index.version == _version:
+            return _index
+        return _rebuild(db)
+
+
+def _rebuild(db: Session = None) -> LocationIndex:
+    global _index
+    version = _version
+    owns_session = db is None
+    if owns_session:
+        db = SessionLocal()
+    try:
+        index = LocationIndex(db.query(models.DefenseLocation).all(), version=version)
+    finally:
+        if owns_session:
+            db.close()
+    _index = index
+    print(f"📍 地點索引已建立：{len(index.records)} 筆 (version {version})")
+    return index
+
+
+@event.listens_for(Session, "before_flush")
+def _track_location_changes(session, flush_context, instances):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, models.DefenseLocation):
+            session.info["locations_dirty"] = True
+            return
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    if session.info.pop("locations_dirty", False):
+        invalidate_location_index()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session):
+    session.info.pop("locations_dirty", None)
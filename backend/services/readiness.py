@@ -0,0 +1,70 @@
+import threading
+import time
+
+# ==========================================
+# 開機暖身進度 (liveness / readiness)
+# 延後啟動模式下，播種與索引暖身在背景執行緒進行，伺服器先開始接受連線；
+# liveness 只要行程活著就回 200，readiness 要等暖身全部完成才會轉為 200
+# ==========================================
+
+
+class Readiness:
+    """記錄目前暖身到哪個步驟、是否完成與失敗原因"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._thread = None
+        self.phase = "starting"
+        self.ready = False
+        self.error = None
+        self.ready_seconds = None
+
+    def _set_phase(self, phase: str):
+        with self._lock:
+            self.phase = phase
+
+    def _mark_ready(self):
+        with self._lock:
+            self.phase = "ready"
+            self.ready = True
+            self.ready_seconds = round(time.monotonic() - self._started, 3)
+
+    def run(self, steps):
+        """依序執行 (步驟名稱, 函式)；例外直接往外拋，與過去同步啟動的行為相同"""
+        for phase, func in steps:
+            self._set_phase(phase)
+            func()
+        self._mark_ready()
+
+    def start_background(self, steps):
+        """在背景執行緒依序執行暖身步驟；失敗時 readiness 維持 503 並記錄原因"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run_background, args=(list(steps),),
+                                        name="startup-warmup", daemon=True)
+        self._thread.start()
+        print("🌅 延後啟動：伺服器先開始接受連線，播種與索引暖身在背景進行")
+
+    def _run_background(self, steps):
+        try:
+            self.run(steps)
+        except Exception as e:
+            with self._lock:
+                self.error = f"{self.phase}: {e}"
+            print(f"❌ 背景暖身失敗 ({self.phase})：{e}")
+            return
+        print(f"✅ 背景暖身完成，耗時 {self.ready_seconds:.2f} 秒，服務已就緒")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "phase": self.phase,
+                "error": self.error,
+                "uptime_seconds": round(time.monotonic() - self._started, 3),
+                "ready_after_seconds": self.ready_seconds,
+            }
+
+
+readiness = Readiness()
@@ -0,0 +1,134 @@
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# ==========================================
+# PPT 背景生成佇列
+# submit_and_generate 在非同步模式下只寫入 DefenseLog 並排入佇列，立即回傳 job_id
+# ==========================================
+
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "2"))
+RENDER_QUEUE_SIZE = int(os.getenv("RENDER_QUEUE_SIZE", "100"))
+# 保留最近多少筆工作狀態供查詢 (超過就淘汰最舊的已完成工作)
+RENDER_JOB_HISTORY = int(os.getenv("RENDER_JOB_HISTORY", "1000"))
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+class QueueFullError(Exception):
+    """佇列已滿，呼叫端應改走同步生成或請使用者稍後再試"""
+
+
+class RenderQueue:
+    """固定數量工作執行緒 + 有上限的等待佇列"""
+
+    def __init__(self, workers: int, max_queued: int, history: int):
+        self.workers = max(1, workers)
+        self.max_queued = max_queued
+        self.history = history
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads = []
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def start(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"render-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        print(f"🧵 PPT 生成佇列已啟動：{self.workers} 個工作執行緒，佇列上限 {self.max_queued}")
+
+    def submit(self, func, *args, **meta) -> str:
+        """
+        排入一個生成工作並回傳 job_id。
+        func(*args) 應回傳 dict，內容會併入工作狀態 (例如 download_url)；meta 為額外記錄的欄位。
+        """
+        job_id = uuid.uuid4().hex
+        job = {"job_id": job_id, "status": JOB_QUEUED, "created_at": time.time(), **meta}
+        with self._lock:
+            self._jobs[job_id] = job
+            self._trim()
+        try:
+            self._queue.put_nowait((job_id, func, args))
+        except queue.Full:
+            with self._lock:
+                self._jobs.pop(job_id, None)
+                self.rejected += 1
+            raise QueueFullError("生成佇列已滿")
+        with self._lock:
+            self.submitted += 1
+        return job_id
+
+    def get(self, job_id: str):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def shutdown(self, wait: bool = True):
+        """通知所有工作執行緒結束；wait=True 時會先把佇列中已排入的工作做完"""
+        for _ in self._threads:
+            self._queue.put((None, None, None))
+        if wait:
+            for t in self._threads:
+                t.join()
+        self._threads = []
+
+    def stats(self):
+        with self._lock:
+            running = sum(1 for job in self._jobs.values() if job["status"] == JOB_RUNNING)
+            return {
+                "workers": self.workers,
+                "queued": self._queue.qsize(),
+                "running": running,
+                "max_queued": self.max_queued,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+            }
+
+    def _trim(self):
+        # 只淘汰已結束的工作，排隊中/執行中的工作一定保留
+        overflow = len(self._jobs) - self.history
+        if overflow <= 0:
+            return
+        for job_id in [k for k, job in self._jobs.items() if job["status"] in (JOB_DONE, JOB_FAILED)][:overflow]:
+            del self._jobs[job_id]
+
+    def _set(self, job_id: str, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields)
+
+    def _worker(self):
+        while True:
+            job_id, func, args = self._queue.get()
+            if job_id is None:
+                break
+            self._set(job_id, status=JOB_RUNNING, started_at=time.time())
+            try:
+                result = func(*args) or {}
+                self._set(job_id, status=JOB_DONE, finished_at=time.time(), **result)
+                with self._lock:
+                    self.completed += 1
+            except Exception as e:
+                print(f"❌ 背景生成 PPT 失敗 (job {job_id})：{e}")
+                self._set(job_id, status=JOB_FAILED, finished_at=time.time(), error=str(e))
+                with self._lock:
+                    self.failed += 1
+
+
+render_queue = RenderQueue(RENDER_WORKERS, RENDER_QUEUE_SIZE, RENDER_JOB_HISTORY)
@@ -0,0 +1,290 @@
+import os
+import re
+import difflib
+import threading
+from collections import namedtuple
+
+import numpy as np
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import models
+from database import SessionLocal
+
+# ==========================================
+# 教授名冊索引 (Roster Index)
+# 開機時建立一次，之後每次 query_committee 直接查表，不再重撈整張 professors 表
+# ==========================================
+
+# 與 ORM 物件脫鉤的輕量紀錄，跨 Session 共用也不會遇到 DetachedInstanceError
+ProfessorRecord = namedtuple(
+    "ProfessorRecord", ["professor_id", "professor_name", "professor_title", "department_name"]
+)
+
+# 預先計算好的姓名特徵：正規化字串、字元集合、bigram 集合
+NameFeatures = namedtuple("NameFeatures", ["norm", "chars", "bigrams"])
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# 名冊人數達到此門檻時，改用 NumPy 批次計分 (小名冊逐筆計算反而比較快)
+BATCH_SCORE_THRESHOLD = int(os.getenv("ROSTER_BATCH_THRESHOLD", "1000"))
+
+# 長度為 1 的姓名，其 n-gram 就是單一字元；以超出 Unicode 範圍的值補在低位，避免與真正的 bigram 撞碼
+_SINGLE_CHAR_BIGRAM = 0x1FFFFF
+
+
+def normalize_member_text(s: str) -> str:
+    return _WHITESPACE_RE.sub("", s or "")
+
+
+def name_ngrams(s: str, n: int = 2):
+    """通用 n-gram 切分，避免硬編碼特定姓名或字形規則"""
+    if len(s) < n:
+        return {s} if s else set()
+    return {s[i:i+n] for i in range(len(s) - n + 1)}
+
+
+def name_features(name: str) -> NameFeatures:
+    norm = normalize_member_text(name)
+    return NameFeatures(norm, set(norm), name_ngrams(norm, 2))
+
+
+def score_features(fa: NameFeatures, fb: NameFeatures) -> float:
+    """以預先計算好的特徵計算混合相似度 (sequence + 字元重疊 + bigram + 位置)"""
+    a, b = fa.norm, fb.norm
+    if not a or not b:
+        return 0.0
+
+    seq_score = difflib.SequenceMatcher(None, a, b).ratio()
+    overlap_score = len(fa.chars & fb.chars) / max(1, len(fa.chars | fb.chars))
+    ngram_score = len(fa.bigrams & fb.bigrams) / max(1, len(fa.bigrams | fb.bigrams))
+
+    max_len = max(len(a), len(b))
+    position_acc = 0.0
+    for idx in range(min(len(a), len(b))):
+        if a[idx] == b[idx]:
+            position_acc += 1.0
+    position_score = position_acc / max(1, max_len)
+
+    return seq_score * 0.35 + overlap_score * 0.2 + ngram_score * 0.2 + position_score * 0.25
+
+
+def _encode_bigram(gram: str) -> int:
+    if len(gram) == 1:
+        return (ord(gram) << 21) | _SINGLE_CHAR_BIGRAM
+    return (ord(gram[0]) << 21) | ord(gram[1])
+
+
+class NameMatrix:
+    """
+    把整份名冊的正規化姓名編成碼位矩陣 (不足補 -1)，
+    讓字元重疊、bigram 重疊與位置分數能以 NumPy 一次算完，而不是逐對跑 Python 迴圈。
+    """
+
+    def __init__(self, norms):
+        self.norms = norms
+        n = len(norms)
+        width = max((len(s) for s in norms), default=0) or 1
+        self.lengths = np.array([len(s) for s in norms], dtype=np.int64)
+        self.codes = np.full((n, width), -1, dtype=np.int64)
+        self.bigram_codes = np.full((n, width), -1, dtype=np.int64)
+        # first 遮罩只標記每列第一次出現的值，等同於集合運算時的去重
+        self.char_first = np.zeros((n, width), dtype=bool)
+        self.bigram_first = np.zeros((n, width), dtype=bool)
+
+        for row, s in enumerate(norms):
+            seen = set()
+            for col, ch in enumerate(s):
+                self.codes[row, col] = ord(ch)
+                if ch not in seen:
+                    seen.add(ch)
+                    self.char_first[row, col] = True
+
+            seen = set()
+            grams = [s] if len(s) == 1 else [s[i:i+2] for i in range(len(s) - 1)]
+            for col, gram in enumerate(grams):
+                self.bigram_codes[row, col] = _encode_bigram(gram)
+                if gram not in seen:
+                    seen.add(gram)
+                    self.bigram_first[row, col] = True
+
+        self.char_count = self.char_first.sum(axis=1)
+        self.bigram_count = self.bigram_first.sum(axis=1)
+
+    def batch_scores(self, query: NameFeatures, rows):
+        """
+        對 rows 指定的名冊列批次計分，回傳 (sequence 分數, 混合相似度) 兩個陣列。
+        各分項的運算順序與 score_features 相同，結果逐位元一致。
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        a = query.norm
+        seq = np.array([difflib.SequenceMatcher(None, a, self.norms[r]).ratio() for r in rows], dtype=np.float64)
+        if not a or len(rows) == 0:
+            return seq, np.zeros(len(rows), dtype=np.float64)
+
+        lengths = self.lengths[rows]
+
+        a_chars = np.array([ord(ch) for ch in query.chars], dtype=np.int64)
+        inter = (np.isin(self.codes[rows], a_chars) & self.char_first[rows]).sum(axis=1)
+        overlap = inter / np.maximum(1, len(query.chars) + self.char_count[rows] - inter)
+
+        a_bigrams = np.array([_encode_bigram(g) for g in query.bigrams], dtype=np.int64)
+        inter_b = (np.isin(self.bigram_codes[rows], a_bigrams) & self.bigram_first[rows]).sum(axis=1)
+        ngram = inter_b / np.maximum(1, len(query.bigrams) + self.bigram_count[rows] - inter_b)
+
+        width = min(len(a), self.codes.shape[1])
+        a_codes = np.array([ord(ch) for ch in a[:width]], dtype=np.int64)
+        position_acc = (self.codes[rows, :width] == a_codes).sum(axis=1)
+        position = position_acc / np.maximum(1, np.maximum(len(a), lengths))
+
+        total = seq * 0.35 + overlap * 0.2 + ngram * 0.2 + position * 0.25
+        total[lengths == 0] = 0.0
+        return seq, total
+
+
+def format_professor(record) -> str:
+    return f"{record.professor_name} {record.professor_title} ({record.department_name})"
+
+
+class RosterIndex:
+    """某一版本教授名冊的唯讀快照，建好之後不再修改，可安全地跨執行緒共用"""
+
+    def __init__(self, professors, version: int = 0):
+        self.version = version
+        self.records = [
+            ProfessorRecord(p.professor_id, p.professor_name, p.professor_title, p.department_name)
+            for p in professors
+        ]
+        # names 保留重名，順序與資料表相同，確保同分時的排序結果與逐筆掃描一致
+        self.names = [r.professor_name for r in self.records]
+        self.by_name = {r.professor_name: r for r in self.records}
+        self.features = [name_features(name) for name in self.names]
+        self.reference_roster = [format_professor(r) for r in self.records]
+
+        # 倒排索引：字元 -> 名冊位置 (遞增排序)
+        # 共享任一 bigram 必然共享字元，所以只需以字元建索引即可涵蓋 bigram 命中
+        self.char_postings = {}
+        for pos, feat in enumerate(self.features):
+            for ch in feat.chars:
+                self.char_postings.setdefault(ch, []).append(pos)
+
+        # 大名冊才建立批次計分用的矩陣
+        self.matrix = None
+        if len(self.names) >= BATCH_SCORE_THRESHOLD:
+            self.matrix = NameMatrix([feat.norm for feat in self.features])
+
+    def candidate_positions(self, query: NameFeatures):
+        """
+        回傳與輸入至少共用一個字元的名冊位置 (依名冊順序)。
+        沒有共用字元的教授，四項分數 (sequence/重疊/bigram/位置) 必定全為 0，不必計算。
+        """
+        positions = set()
+        for ch in query.chars:
+            positions.update(self.char_postings.get(ch, ()))
+        return sorted(positions)
+
+    def _score_positions(self, query: NameFeatures, positions):
+        """回傳 (sequence 分數, 混合相似度)，兩者皆與 positions 等長"""
+        if self.matrix is not None:
+            return self.matrix.batch_scores(query, positions)
+        seq = [difflib.SequenceMatcher(None, query.norm, self.features[pos].norm).ratio() for pos in positions]
+        total = [score_features(query, self.features[pos]) for pos in positions]
+        return seq, total
+
+    def match(self, clean_name: str, top_n: int = 3):
+        """
+        一次算出混合相似度前 N 名與 difflib 最佳分數。
+        兩者共用同一份 SequenceMatcher 結果，不必對同一組姓名算兩次。
+        """
+        query = name_features(clean_name)
+        positions = self.candidate_positions(query)
+        if not positions:
+            # 剪枝後為空才退回全表掃描
+            positions = list(range(len(self.names)))
+        if not positions:
+            return [], ("", 0.0)
+
+        seq, total = self._score_positions(query, positions)
+
+        # 穩定排序 + 位置依名冊順序輸入，同分時的先後與全表掃描完全相同
+        if self.matrix is not None:
+            order = np.argsort(-total, kind="stable")[:top_n]
+        else:
+            order = sorted(range(len(positions)), key=total.__getitem__, reverse=True)[:top_n]
+        candidates = [(self.names[positions[i]], float(total[i])) for i in order]
+
+        # 候選不足 top_n 時，以名冊順序補上 0 分者，與全表掃描的前 N 名保持一致
+        if len(candidates) < top_n:
+            picked = set(positions)
+            for pos, name in enumerate(self.names):
+                if len(candidates) >= top_n:
+                    break
+                if pos not in picked:
+                    candidates.append((name, 0.0))
+
+        best = int(np.argmax(seq)) if self.matrix is not None else max(range(len(positions)), key=seq.__getitem__)
+        best_difflib = (self.names[positions[best]], float(seq[best]))
+        return candidates, best_difflib
+
+
+# ==========================================
+# 全域索引與失效機制
+# ==========================================
+_lock = threading.Lock()
+_index = None
+# 每次教授資料異動就遞增；索引記住自己是由哪一版建出來的，版本不同即視為過期
+_version = 0
+
+
+def invalidate_roster_index():
+    global _version
+    with _lock:
+        _version += 1
+
+
+def get_roster_index(db: Session = None) -> RosterIndex:
+    """取得目前的名冊索引，若尚未建立或已失效則重建"""
+    index = _index
+    if index is not None and index.version == _version:
+        return index
+
+    with _lock:
+        if _index is not None and _index.version == _version:
+            return _index
+        return _rebuild(db)
+
+
+def _rebuild(db: Session = None) -> RosterIndex:
+    global _index
+    version = _version
+    owns_session = db is None
+    if owns_session:
+        db = SessionLocal()
+    try:
+        index = RosterIndex(db.query(models.Professor).all(), version=version)
+    finally:
+        if owns_session:
+            db.close()
+    _index = index
+    print(f"📇 教授名冊索引已建立：{len(index.records)} 位 (version {version})")
+    return index
+
+
+@event.listens_for(Session, "before_flush")
+def _track_professor_changes(session, flush_context, instances):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, models.Professor):
+            session.info["roster_dirty"] = True
+            return
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    # 等交易真正提交後才讓索引失效，避免其他請求搶先用到尚未提交的舊資料重建
+    if session.info.pop("roster_dirty", False):
+        invalidate_roster_index()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session):
+    session.info.pop("roster_dirty", None)
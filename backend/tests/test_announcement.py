@@ -0,0 +1,32 @@
+from types import SimpleNamespace
+
+from services.announcement import schedule_sort_key
+
+# ==========================================
+# 合併簡報的場次排序：依實際日期與時間，而不是顯示字串的字典序
+# ==========================================
+
+
+def make_log(student_id: str, date_text: str, time_text: str):
+    return SimpleNamespace(student_id=student_id, defense_date_text=date_text, defense_time_text=time_text)
+
+
+def test_schedule_sort_key_orders_by_parsed_date_and_time():
+    logs = [
+        make_log("oct_morning", "民國115年10月1日(星期四)", "9:00"),
+        make_log("jun_afternoon", "民國115年6月20日(星期六)", "14:00"),
+        make_log("jun_morning", "民國115年6月20日(星期六)", "9:00"),
+        make_log("prev_year", "民國114年12月31日(星期三)", "09:30"),
+    ]
+    ordered = [log.student_id for log in sorted(logs, key=schedule_sort_key)]
+    assert ordered == ["prev_year", "jun_morning", "jun_afternoon", "oct_morning"]
+
+
+def test_schedule_sort_key_puts_unparsed_values_last():
+    logs = [
+        make_log("free_text_date", "下週二", "10:00"),
+        make_log("free_text_time", "民國115年6月20日(星期六)", "下午"),
+        make_log("parsed", "民國115年6月20日(星期六)", "16:30"),
+    ]
+    ordered = [log.student_id for log in sorted(logs, key=schedule_sort_key)]
+    assert ordered == ["parsed", "free_text_time", "free_text_date"]
@@ -0,0 +1,181 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import anyio
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from starlette.requests import ClientDisconnect
+
+import main
+import services.dify_client as dify_client
+from services.chat_limiter import ChatLimiter, chat_limiter
+
+# ==========================================
+# 對話代理與 Dify SSE 串流的銜接
+# 在本機起一個模仿 Dify chat-messages 的假伺服器，回覆片段刻意拆在不同的 chunk 裡送出
+# ==========================================
+
+CONV_ID = "conv-123"
+
+
+def dify_chunks():
+    events = [
+        {"event": "agent_thought", "conversation_id": CONV_ID, "thought": ""},
+        {"event": "agent_message", "conversation_id": CONV_ID, "answer": "您好，"},
+        {"event": "agent_message", "conversation_id": CONV_ID, "answer": "王小明"},
+        {"event": "message_end", "conversation_id": CONV_ID},
+    ]
+    lines = [f"data: {json.dumps(e, ensure_ascii=False)}\n\n".encode() for e in events]
+    # 心跳事件、無法解析的 data 行，以及被切在 chunk 中間的一行都應該被正確處理
+    yield b"event: ping\n\n"
+    yield b"data: {not json\n\n"
+    for line in lines:
+        yield line[:7]
+        yield line[7:]
+
+
+class StubDifyHandler(BaseHTTPRequestHandler):
+    received = []
+    status = 200
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        StubDifyHandler.received.append((self.headers["Authorization"], body))
+        if self.status != 200:
+            payload = b'{"code": "invalid_param"}'
+            self.send_response(self.status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for chunk in dify_chunks():
+            self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def stub_dify():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubDifyHandler)
+    StubDifyHandler.protocol_version = "HTTP/1.1"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1/chat-messages"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(stub_dify, monkeypatch):
+    monkeypatch.setenv("DIFY_API_URL", stub_dify)
+    monkeypatch.setenv("DIFY_API_KEY", "app-test")
+    # 學生資料不是這裡要測的部分，不依賴本機資料庫
+    monkeypatch.setattr(main, "build_dify_request", lambda payload, student_id: (
+        stub_dify,
+        {"Authorization": "Bearer app-test", "Content-Type": "application/json"},
+        {"query": payload.query, "response_mode": "streaming", "user": student_id},
+    ))
+    # 每個測試各用一個新的連線池，不沿用前一個事件迴圈留下的連線
+    monkeypatch.setattr(dify_client, "_client", None)
+    monkeypatch.setattr(StubDifyHandler, "status", 200)
+    StubDifyHandler.received.clear()
+    yield TestClient(main.app)
+    assert chat_limiter.stats()["in_flight"] == 0
+
+
+def parse_sse(text: str):
+    return [json.loads(block[6:]) for block in text.split("\n\n") if block.startswith("data: ")]
+
+
+def test_stream_relays_dify_events(client):
+    with client.stream("POST", "/api/v1/chat", json={"query": "你好", "stream": True},
+                       headers={"X-Student-Id": "M11402165"}) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = parse_sse(response.read().decode())
+
+    assert events == [
+        {"event": "start", "conversation_id": CONV_ID},
+        {"event": "delta", "answer": "您好，"},
+        {"event": "delta", "answer": "王小明"},
+        {"event": "end", "conversation_id": CONV_ID, "answer": "您好，王小明"},
+    ]
+    authorization, body = StubDifyHandler.received[-1]
+    assert authorization == "Bearer app-test"
+    assert body["response_mode"] == "streaming" and body["user"] == "M11402165"
+
+
+def test_non_stream_collects_answer(client):
+    response = client.post("/api/v1/chat", json={"query": "你好"}, headers={"X-Student-Id": "M11402165"})
+    assert response.status_code == 200
+    assert response.json() == {"answer": "您好，王小明", "conversation_id": CONV_ID}
+
+
+def test_upstream_error_releases_slot(client, monkeypatch):
+    monkeypatch.setattr(StubDifyHandler, "status", 400)
+    response = client.post("/api/v1/chat", json={"query": "你好", "stream": True},
+                           headers={"X-Student-Id": "M11402165"})
+    assert response.status_code == 500
+    assert "invalid_param" in response.json()["detail"]
+
+
+def test_disconnect_before_stream_starts_releases_slot(client, monkeypatch):
+    # 前端在回應標頭送出時就已斷線：串流產生器從未開始，名額仍要歸還、上游的 Dify 連線也要關閉
+    opened = []
+    original_send = httpx.AsyncClient.send
+
+    async def recording_send(self, request, **kwargs):
+        response = await original_send(self, request, **kwargs)
+        opened.append(response)
+        return response
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        raise OSError("client went away")
+
+    async def run():
+        response = await main.chat_proxy(main.ChatRequest(query="你好", stream=True), "M11402165")
+        assert chat_limiter.stats()["in_flight"] == 1
+        with pytest.raises(ClientDisconnect):
+            await response({"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send)
+
+    monkeypatch.setattr(httpx.AsyncClient, "send", recording_send)
+    anyio.run(run)
+    assert len(opened) == 1 and opened[0].is_closed
+
+
+def test_hand_off_at_wait_timeout_admits_waiter(monkeypatch):
+    # 前一個對話歸還名額的同一輪事件迴圈裡，等待者剛好逾時：名額已交給它，必須放行而不是回 503 後讓名額懸空
+    limiter = ChatLimiter(max_concurrent=1, max_waiting=5, max_wait_seconds=1, per_student_limit=0, retry_after=1)
+
+    async def run():
+        holder = await limiter.acquire("A")
+
+        async def wait_for_racing_hand_off(future, timeout):
+            await holder.release()
+            assert future.done()
+            raise asyncio.TimeoutError
+
+        monkeypatch.setattr(asyncio, "wait_for", wait_for_racing_hand_off)
+        waiter = await limiter.acquire("B")
+        monkeypatch.undo()
+        assert limiter.stats()["in_flight"] == 1
+        await waiter.release()
+
+    asyncio.run(run())
+    stats = limiter.stats()
+    assert stats["in_flight"] == 0 and stats["waiting"] == 0
+    assert stats["admitted"] == 2 and stats["rejected_busy"] == 0
@@ -0,0 +1,70 @@
+import os
+
+from services.download_cache import DownloadCache
+
+# ==========================================
+# 下載目錄磁碟快取：使用中 (pin) 的檔案不會被淘汰
+# ==========================================
+
+
+def write_file(path, size=1000):
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+
+
+def make_cache(tmp_path, max_bytes=1500):
+    store = tmp_path / ".store"
+    store.mkdir()
+    return DownloadCache(str(tmp_path), str(store), max_bytes)
+
+
+def test_pinned_file_survives_eviction_until_unpinned(tmp_path):
+    cache = make_cache(tmp_path)
+    names = [f"defense_S_{i}.pptx" for i in range(4)]
+    first = str(tmp_path / names[0])
+
+    cache.pin(first)
+    for name in names:
+        write_file(tmp_path / name)
+        cache.add(name)
+
+    # 超出預算時跳過 pin 住的最舊檔案，改淘汰之後的檔案；pin 期間暫時超出預算
+    assert os.path.exists(first)
+    assert [os.path.exists(tmp_path / name) for name in names[1:]] == [False, False, True]
+    assert cache.stats()["bytes"] == 2000
+
+    # 解除 pin 時補做淘汰
+    cache.unpin(first)
+    assert not os.path.exists(first)
+    assert cache.stats()["bytes"] == 1000 and cache.stats()["pinned"] == 0
+
+
+def test_pins_are_counted(tmp_path):
+    cache = make_cache(tmp_path)
+    path = str(tmp_path / "defense_S_0.pptx")
+    write_file(path)
+    cache.add("defense_S_0.pptx")
+
+    with cache.pinned(path):
+        with cache.pinned(path):
+            pass
+        write_file(tmp_path / "defense_S_1.pptx")
+        cache.add("defense_S_1.pptx")
+        assert os.path.exists(path)
+    assert not os.path.exists(path)
+
+
+def test_sweep_skips_pinned_store_blob(tmp_path):
+    cache = make_cache(tmp_path)
+    # 剛渲染、還沒 link 到下載目錄的實體檔只有一個連結，淘汰後的清除不能刪掉它
+    pinned_blob = str(tmp_path / ".store" / "pinned.pptx")
+    orphan_blob = str(tmp_path / ".store" / "orphan.pptx")
+    write_file(pinned_blob)
+    write_file(orphan_blob)
+
+    with cache.pinned(pinned_blob):
+        for i in range(3):
+            write_file(tmp_path / f"defense_S_{i}.pptx")
+            cache.add(f"defense_S_{i}.pptx")
+        assert os.path.exists(pinned_blob)
+        assert not os.path.exists(orphan_blob)
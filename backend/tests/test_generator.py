@@ -0,0 +1,70 @@
+import io
+import zipfile
+
+import pytest
+from pptx import Presentation
+
+import schemas
+from services.generator import load_template, render_ppt
+
+# ==========================================
+# PPT 快速路徑 (直接替換投影片 XML) 與 python-pptx 路徑的一致性
+# ==========================================
+
+
+def make_payload(**overrides) -> schemas.FullPPTData:
+    data = dict(
+        student_id="M11402165",
+        student_name="王小明",
+        thesis_title_zh="以圖神經網路預測 <口試> & 排程",
+        thesis_title_en='Scheduling "Defense" Sessions with GNNs',
+        advisor_full_text="呂政修 教授 電子工程系",
+        defense_date_text="民國115年6月20日(星期六)",
+        defense_time_text="14:00",
+        location_full_text="T2-202 第二教學大樓",
+        committee_members=["鄭瑞光 教授 (電機工程系)", "吳晉賢 副教授 (資訊工程系)", "呂政修 教授 (電子工程系)"],
+    )
+    data.update(overrides)
+    return schemas.FullPPTData(**data)
+
+
+def slide_texts(content: bytes):
+    prs = Presentation(io.BytesIO(content))
+    return [
+        [run.text for run in paragraph.runs]
+        for shape in prs.slides[0].shapes if shape.has_text_frame
+        for paragraph in shape.text_frame.paragraphs
+    ]
+
+
+@pytest.fixture(scope="module", autouse=True)
+def compiled_template():
+    _, _, compiled = load_template()
+    if compiled is None:
+        pytest.skip("模板無法預編譯，快速路徑不會啟用")
+    return compiled
+
+
+@pytest.mark.parametrize("payload", [
+    make_payload(),
+    # XML 特殊字元、控制字元與看起來像佔位符的內容都必須與 python-pptx 的處理方式相同
+    make_payload(thesis_title_zh="題目<&>\r\x07", thesis_title_en="Title {{student_id}} 'quoted'"),
+    make_payload(committee_members=[], defense_time_text=""),
+    make_payload(student_name=""),
+], ids=["normal", "escaping", "empty_committee", "empty_name"])
+def test_fast_path_matches_python_pptx(payload, compiled_template):
+    fast = render_ppt(payload, fast_path=True)
+    slow = render_ppt(payload, fast_path=False)
+
+    assert slide_texts(fast) == slide_texts(slow)
+    slide_member = compiled_template.slide_member
+    with zipfile.ZipFile(io.BytesIO(fast)) as zf_fast, zipfile.ZipFile(io.BytesIO(slow)) as zf_slow:
+        assert zf_fast.testzip() is None
+        assert zf_fast.read(slide_member) == zf_slow.read(slide_member)
+
+
+def test_fast_path_replaces_every_placeholder():
+    texts = "\n".join("".join(runs) for runs in slide_texts(render_ppt(make_payload(), fast_path=True)))
+    assert "{{" not in texts
+    assert "王小明" in texts and "T2-202 第二教學大樓" in texts
+    assert "    吳晉賢 副教授 (資訊工程系)" in texts
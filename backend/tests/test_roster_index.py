@@ -0,0 +1,98 @@
+import difflib
+import random
+
+import pytest
+
+import services.roster_index as roster_index
+from services.roster_index import ProfessorRecord, RosterIndex, normalize_member_text
+
+# ==========================================
+# 名冊索引與舊版逐筆比對的等價性
+# 舊版 query_committee 對整份名冊逐一計分 (下方照抄)，索引剪枝與批次計分的結果必須完全相同
+# ==========================================
+
+SURNAMES = "陳林黃張李王吳劉蔡楊許鄭謝郭洪曾邱廖賴周徐蘇葉莊呂江何蕭羅高潘簡朱鍾游彭詹胡施沈余盧梁趙顏柯翁魏孫戴"
+GIVEN = "志明俊傑淑芬美玲家豪冠宇怡君雅婷宗翰承恩瑞光晉賢政修建宏文彬子涵柏翰佳穎欣怡"
+
+
+def old_similarity(input_name: str, prof_name: str) -> float:
+    a = normalize_member_text(input_name)
+    b = normalize_member_text(prof_name)
+    if not a or not b:
+        return 0.0
+
+    seq_score = difflib.SequenceMatcher(None, a, b).ratio()
+
+    set_a = set(a)
+    set_b = set(b)
+    overlap_score = len(set_a & set_b) / max(1, len(set_a | set_b))
+
+    def ngrams(s: str, n: int = 2):
+        if len(s) < n:
+            return {s} if s else set()
+        return {s[i:i+n] for i in range(len(s) - n + 1)}
+
+    ngram_a = ngrams(a, 2)
+    ngram_b = ngrams(b, 2)
+    ngram_score = len(ngram_a & ngram_b) / max(1, len(ngram_a | ngram_b))
+
+    max_len = max(len(a), len(b))
+    position_acc = 0.0
+    for idx in range(min(len(a), len(b))):
+        if a[idx] == b[idx]:
+            position_acc += 1.0
+    position_score = position_acc / max(1, max_len)
+
+    return seq_score * 0.35 + overlap_score * 0.2 + ngram_score * 0.2 + position_score * 0.25
+
+
+def old_match(prof_names, clean_name: str):
+    candidates = sorted(
+        [(name, old_similarity(clean_name, name)) for name in prof_names],
+        key=lambda x: x[1],
+        reverse=True
+    )[:3]
+    best_difflib = sorted(
+        [(name, difflib.SequenceMatcher(None, normalize_member_text(clean_name), normalize_member_text(name)).ratio()) for name in prof_names],
+        key=lambda x: x[1],
+        reverse=True
+    )[0]
+    return candidates, best_difflib
+
+
+@pytest.fixture(scope="module")
+def roster():
+    rng = random.Random(7)
+
+    def random_name():
+        return rng.choice(SURNAMES) + "".join(rng.choice(GIVEN) for _ in range(rng.choice([0, 1, 2, 2, 2, 3])))
+
+    records = [ProfessorRecord(f"P{i}", random_name(), "教授", "資訊工程系") for i in range(10000)]
+    # 空白姓名、含空白的複姓與重複字元都是舊版比對容易出現邊界差異的情況
+    records += [
+        ProfessorRecord("PE", "", "教授", "資訊工程系"),
+        ProfessorRecord("PS", "歐陽 娜娜", "教授", "資訊工程系"),
+        ProfessorRecord("PA", "明明明", "教授", "資訊工程系"),
+    ]
+    queries = [random_name() for _ in range(30)] + ["歐陽娜", "Smith", "X", "鑫", "瑞", "陳", "明明", "明明明明"]
+    # 舊版全表掃描很慢，預期結果只算一次給兩種計分方式共用
+    names = [r.professor_name for r in records]
+    expected = {query: old_match(names, query) for query in queries}
+    return records, expected
+
+
+@pytest.mark.parametrize("batch_threshold", [10 ** 9, 0], ids=["pruned", "numpy_batch"])
+def test_match_equals_full_scan(roster, monkeypatch, batch_threshold):
+    records, expected = roster
+    monkeypatch.setattr(roster_index, "BATCH_SCORE_THRESHOLD", batch_threshold)
+    index = RosterIndex(records)
+    assert (index.matrix is None) == (batch_threshold > len(records))
+
+    for query, result in expected.items():
+        assert index.match(query) == result, query
+
+
+def test_candidate_positions_share_a_character():
+    index = RosterIndex([ProfessorRecord(str(i), name, "教授", "系") for i, name in enumerate(["鄭瑞光", "吳晉賢", "王大明"])])
+    assert index.candidate_positions(roster_index.name_features("瑞光")) == [0]
+    assert index.candidate_positions(roster_index.name_features("張忠謀")) == []